@@ -0,0 +1,267 @@
+'''
+Drives representative layouts without a panel and reports how fast frames are produced.
+
+Run with `python benchmark.py` (see --help). Every scenario draws a fixed number of
+frames back to back through DisplayManager.update_display() and reports frames per
+second, median and 99th percentile frame times and the number of PIL images allocated per frame.
+'''
+
+import common.display_manager as dm
+from common.plugin import PluginBase
+from common.output import NullOutput, RecorderOutput, DoubleBufferedOutput
+from common.fakematrix import FakeRGBMatrix
+from common.color import ColorPipeline, ColorCorrectedOutput
+from PIL import Image
+
+import argparse
+import asyncio
+import random
+import time
+
+SCENARIOS = {}
+
+def scenario(name):
+    '''
+    Registers a scenario. Scenarios take a DisplayManager, build and return a layout
+    and a step(frame) callable that is called before every measured frame to simulate activity.
+    '''
+    def register(func):
+        SCENARIOS[name] = func
+        return func
+    return register
+
+@scenario("clock")
+def clock_scenario(display_manager):
+    layout = display_manager.new_layout()
+    clock = layout.add_plugin("modules.clock", width = 40, height = 10, x = 64//2-20, y = 64//2-8, z_index = 1)
+    layout.add_plugin("modules.test", width = 64, height = 64)
+
+    def step(frame):
+        clock._show_colon = frame % 2 == 0
+        clock.invalidate()
+    return layout, step
+
+@scenario("slideshow")
+def slideshow_scenario(display_manager):
+    layout = display_manager.new_layout()
+    slideshow = layout.add_plugin("modules.image", width = 64, height = 64)
+    slideshow.add_image("assets/images/testalbumcover.png")
+    slideshow.add_image("assets/images/testalbumcover2.png")
+    slideshow.hold_time = 3600 # Switched manually below
+
+    async def step(frame):
+        if frame % 10 == 0:
+            await slideshow.show_image(slideshow._current_image_ind + 1)
+    return layout, step
+
+@scenario("debug-text")
+def debug_text_scenario(display_manager):
+    layout = display_manager.new_layout()
+    text = layout.add_plugin("modules.debug.text", width = 64, height = 64, text = "192.\n168.\n1.\n100")
+    layout.add_plugin("modules.debug.text", width = 64, height = 16, y = 48, text = "static") # Cached, never redrawn
+
+    def step(frame):
+        text.text = f"192.\n168.\n1.\n{frame % 256}"
+    return layout, step
+
+@scenario("marquee")
+def marquee_scenario(display_manager):
+    '''
+    A line of text scrolling over a static background
+    '''
+    layout = display_manager.new_layout()
+    layout.add_plugin("modules.test", width = 64, height = 64)
+    marquee = layout.add_plugin("modules.marquee", width = 64, height = 10, y = 27, z_index = 1, speed = 600,
+                                text = "The quick brown fox jumps over the lazy dog")
+
+    def step(frame):
+        marquee.invalidate() # The offset follows the clock, drawing every frame measures the worst case
+    return layout, step
+
+def effect_scenario(module):
+    '''
+    A procedural effect (see common.effects) filling the panel, computing a new frame every frame
+    '''
+    def build(display_manager):
+        layout = display_manager.new_layout()
+        effect = layout.add_plugin(module, width = 64, height = 64, fps = 0, seed = 0) # Advanced by step() rather than its own tick
+
+        def step(frame):
+            effect.invalidate()
+        return layout, step
+    return build
+
+for effect in ("plasma", "fire", "starfield", "life"):
+    scenario(effect)(effect_scenario(f"modules.effects.{effect}"))
+
+@scenario("overlapping")
+def overlapping_scenario(display_manager):
+    '''
+    Lots of overlapping RGB and RGBA plugins, one of which moves every frame
+    '''
+    rand = random.Random(0)
+    layout = display_manager.new_layout()
+    plugins = []
+    for i in range(24):
+        width, height = rand.randint(8, 32), rand.randint(8, 32)
+        kwargs = dict(width = width, height = height, x = rand.randint(0, 64 - width), y = rand.randint(0, 64 - height), z_index = rand.randint(0, 5))
+        if i % 2:
+            plugins.append(layout.add_plugin("modules.debug.text", text = str(i), **kwargs))
+        else:
+            plugins.append(layout.add_plugin("modules.test", **kwargs))
+
+    async def step(frame):
+        plugin = plugins[frame % len(plugins)]
+        coords = layout._plugin_coordinates[plugin]
+        width = coords[2] - coords[0]
+        await layout.change_plugin_coords(plugin, x = (coords[0] + 1) % (64 - width + 1))
+    return layout, step
+
+@scenario("grid")
+def grid_scenario(display_manager):
+    '''
+    A dashboard-like grid of 256 small tiles, one of which changes every frame.
+    An opaque panel covers a quarter of the grid, hiding the tiles beneath it.
+    '''
+    layout = display_manager.new_layout()
+    tiles = [layout.add_plugin("modules.test", width = 4, height = 4, x = x * 4, y = y * 4) for y in range(16) for x in range(16)]
+    layout.add_plugin("modules.test", width = 32, height = 32, z_index = 1)
+
+    def step(frame):
+        tiles[frame % len(tiles)].invalidate()
+    return layout, step
+
+class TranslucentPlugin(PluginBase):
+
+    '''
+    A colored RGBA gradient fading from transparent to opaque, like an overlay
+    '''
+
+    def __init__(self, dimensions, display_manager, color):
+        super().__init__(dimensions, display_manager)
+        self._canvas = Image.new("RGBA", dimensions, color)
+        self._canvas.putalpha(Image.linear_gradient("L").resize(dimensions))
+
+    async def draw(self):
+        return self._canvas
+
+@scenario("translucent")
+def translucent_scenario(display_manager):
+    '''
+    A stack of large, overlapping, semi-transparent plugins that are all recomposited every frame
+    '''
+    rand = random.Random(0)
+    layout = display_manager.new_layout()
+    plugins = []
+    for i in range(16):
+        width, height = rand.randint(24, 64), rand.randint(24, 64)
+        plugin = TranslucentPlugin((width, height), display_manager, tuple(rand.sample(range(0, 255), 3)))
+        plugins.append(layout.add_plugin(plugin, width = width, height = height, x = rand.randint(0, 64 - width), y = rand.randint(0, 64 - height), z_index = i))
+
+    def step(frame):
+        layout.damage() # Unchanged content, so this measures blending rather than image conversion
+    return layout, step
+
+class AllocationCounter():
+
+    '''
+    Counts PIL Image objects created while active. Pixel buffers are allocated by Pillow
+    outside of the Python allocator, so tracemalloc can't see them.
+    '''
+
+    def __init__(self):
+        self.count = 0
+        self._original_init = None
+
+    def __enter__(self):
+        self._original_init = Image.Image.__init__
+        original_init = self._original_init
+        def counting_init(im, *args, **kwargs):
+            self.count += 1
+            original_init(im, *args, **kwargs)
+        Image.Image.__init__ = counting_init
+        return self
+
+    def __exit__(self, *exc):
+        Image.Image.__init__ = self._original_init
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def make_output(name):
+    if name == "null":
+        return NullOutput()
+    if name == "recorder":
+        return RecorderOutput()
+    if name == "double-buffered":
+        return DoubleBufferedOutput(FakeRGBMatrix(width = 64, height = 64))
+    raise ValueError(f"Unknown output {name}")
+
+def make_color_pipeline(name):
+    '''
+    A typical panel correction: gamma, warmer white balance and dimmed, with the given dithering ("lut" for none)
+    '''
+    return ColorPipeline(gamma = 2.2, white_balance = (1.0, 0.85, 0.7), brightness = 0.5, dither = "none" if name == "lut" else name)
+
+async def run_scenario(name, args):
+    output = make_output(args.output)
+    if args.color != "none":
+        output = ColorCorrectedOutput(output, make_color_pipeline(args.color))
+    display_manager = dm.DisplayManager(output = output, width = 64, height = 64, render_mode = args.render_mode, compositor = args.compositor)
+    if args.color != "none":
+        output.stats = display_manager.stats
+    display_manager.start_scheduler() # Coalesces draws requested by plugin background tasks so they don't race the benchmark
+    layout, step = SCENARIOS[name](display_manager)
+    await display_manager.switch_layout(layout)
+
+    for frame in range(args.warmup):
+        await maybe_await(step(frame))
+        await display_manager.update_display()
+
+    frame_times = []
+    damaged = 0
+    with AllocationCounter() as allocations:
+        start = time.perf_counter()
+        for frame in range(args.frames):
+            await maybe_await(step(frame))
+            frame_start = time.perf_counter()
+            await display_manager.update_display()
+            frame_times.append(time.perf_counter() - frame_start)
+            damaged += layout.last_damaged_area
+        total = time.perf_counter() - start
+
+    await display_manager.stop_scheduler()
+    return {
+        "fps": args.frames / total,
+        "p50": percentile(frame_times, 0.50) * 1000,
+        "p99": percentile(frame_times, 0.99) * 1000,
+        "allocs": allocations.count / args.frames,
+        "damaged": damaged / args.frames,
+        "color": display_manager.stats.histograms["color.apply_ms"].summary()["mean"] if args.color != "none" else None,
+    }
+
+async def maybe_await(result):
+    if asyncio.iscoroutine(result):
+        await result
+
+async def main(args):
+    names = args.scenario or list(SCENARIOS)
+    color = args.color != "none"
+    print(f"{'scenario':<16}{'fps':>10}{'p50 ms':>10}{'p99 ms':>10}{'allocs/f':>10}{'damage px/f':>13}" + (f"{'color ms':>10}" if color else ""))
+    for name in names:
+        result = await run_scenario(name, args)
+        print(f"{name:<16}{result['fps']:>10.1f}{result['p50']:>10.3f}{result['p99']:>10.3f}{result['allocs']:>10.1f}{result['damaged']:>13.0f}"
+              + (f"{result['color']:>10.3f}" if color else ""))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmarks rendering of representative layouts")
+    parser.add_argument("--scenario", action = "append", choices = list(SCENARIOS), help = "Scenario to run, can be repeated (default: all)")
+    parser.add_argument("--frames", type = int, default = 500)
+    parser.add_argument("--warmup", type = int, default = 20)
+    parser.add_argument("--render-mode", choices = dm.RENDER_MODES, default = "inline")
+    parser.add_argument("--compositor", choices = ("pil", "numpy"), default = "pil")
+    parser.add_argument("--output", choices = ("null", "recorder", "double-buffered"), default = "null")
+    parser.add_argument("--color", choices = ("none", "lut", "ordered", "temporal"), default = "none",
+                        help = "Color correct frames (gamma, white balance and brightness) with the given dithering before output")
+    asyncio.run(main(parser.parse_args()))
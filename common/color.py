@@ -0,0 +1,229 @@
+from common.output import OutputBackend
+from common.stats import Stats
+
+from PIL import Image
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+DITHER_MODES = ("none", "ordered", "temporal")
+
+# 4x4 Bayer matrix: the order in which pixels of a 4x4 block cross a rounding threshold
+BAYER = ((0, 8, 2, 10),
+         (12, 4, 14, 6),
+         (3, 11, 1, 9),
+         (15, 7, 13, 5))
+BAYER_LEVELS = 16
+
+class ColorPipeline():
+
+    '''
+    Color correction applied to finished frames: a gamma curve, per-channel white balance and brightness.
+
+    Every setting folds into a lookup table per channel that is rebuilt only when a setting changes,
+    so a frame costs one table lookup per subpixel. The tables are computed in floating point; dithering
+    spreads the rounding error of the final 8-bit value over neighbouring pixels with a 4x4 Bayer
+    pattern ("ordered"), which also moves every frame ("temporal") so each pixel averages out over
+    16 frames. This keeps dark gradients from banding when gamma and low brightness squash them into
+    a handful of levels. Dithering requires numpy.
+    '''
+
+    def __init__(self, *, gamma: float = 1.0, white_balance = (1.0, 1.0, 1.0), brightness: float = 1.0, dither: str = "none"):
+        self._gamma = gamma
+        self._white_balance = tuple(white_balance)
+        self._brightness = brightness
+        self._point_lut = None # For Image.point, no dithering
+        self._table = None # (thresholds * 3 * 256,) uint8, indexed by (threshold * 3 + channel) * 256 + value
+        self._indices: dict[tuple, object] = {} # (height, width, phase) -> index base for every subpixel
+        self._scratch = None
+        self.frame = 0
+        self.dither = dither
+
+    def _changed(self):
+        self._point_lut = None
+        self._table = None
+
+    @property
+    def gamma(self) -> float:
+        return self._gamma
+
+    @gamma.setter
+    def gamma(self, value: float):
+        if value <= 0:
+            raise ValueError("gamma must be positive")
+        self._gamma = value
+        self._changed()
+
+    @property
+    def white_balance(self) -> tuple[float, float, float]:
+        return self._white_balance
+
+    @white_balance.setter
+    def white_balance(self, value):
+        value = tuple(value)
+        if len(value) != 3 or min(value) < 0:
+            raise ValueError("white_balance must be three non-negative channel gains")
+        self._white_balance = value
+        self._changed()
+
+    @property
+    def brightness(self) -> float:
+        return self._brightness
+
+    @brightness.setter
+    def brightness(self, value: float):
+        self._brightness = min(1.0, max(0.0, value))
+        self._changed()
+
+    @property
+    def dither(self) -> str:
+        return self._dither
+
+    @dither.setter
+    def dither(self, value: str):
+        if value not in DITHER_MODES:
+            raise ValueError(f"Unknown dither mode {value!r}, expected one of {', '.join(DITHER_MODES)}")
+        if value != "none" and np is None:
+            raise ImportError("Dithering requires numpy to be installed")
+        self._dither = value
+        self._indices.clear()
+        self._changed()
+
+    @property
+    def identity(self) -> bool:
+        '''
+        Whether the pipeline leaves frames unchanged
+        '''
+        return self._gamma == 1.0 and self._white_balance == (1.0, 1.0, 1.0) and self._brightness == 1.0 and self._dither == "none"
+
+    def _levels(self, channel: int) -> list[float]:
+        '''
+        The corrected value of every input level of a channel, unrounded (0 - 255)
+        '''
+        gain = self._white_balance[channel] * self._brightness
+        return [min(255.0, 255.0 * (value / 255) ** self._gamma * gain) for value in range(256)]
+
+    @property
+    def point_lut(self) -> list[int]:
+        '''
+        The tables for Image.point on an RGB image (rounded, no dithering)
+        '''
+        if self._point_lut is None:
+            self._point_lut = [int(level + 0.5) for channel in range(3) for level in self._levels(channel)]
+        return self._point_lut
+
+    @property
+    def table(self):
+        '''
+        Flat uint8 lookup table with one 256 entry table per dither threshold and channel
+        '''
+        if self._table is None:
+            levels = np.array([self._levels(channel) for channel in range(3)]) # (3, 256)
+            if self._dither == "none":
+                thresholds = np.array([0.5])
+            else:
+                thresholds = (np.arange(BAYER_LEVELS) + 0.5) / BAYER_LEVELS
+            table = np.floor(levels[None, :, :] + thresholds[:, None, None])
+            self._table = np.clip(table, 0, 255).astype(np.uint8).reshape(-1)
+        return self._table
+
+    def _index_base(self, height: int, width: int, phase: int):
+        '''
+        (height, width, 3) uint16 offsets into table picking every subpixel's threshold and channel.
+        Cached, there are at most 16 phases per frame size.
+        '''
+        key = (height, width, phase)
+        base = self._indices.get(key)
+        if base is None:
+            if self._dither == "none":
+                thresholds = np.zeros((height, width), dtype = np.uint16)
+            else:
+                bayer = np.array(BAYER, dtype = np.uint16)
+                rows = (np.arange(height) + phase // 4) % 4
+                columns = (np.arange(width) + phase % 4) % 4
+                thresholds = bayer[rows[:, None], columns[None, :]]
+            base = (thresholds[:, :, None] * 3 + np.arange(3, dtype = np.uint16)) * 256
+            self._indices[key] = base
+        return base
+
+    def apply(self, image: Image.Image) -> Image.Image:
+        '''
+        Returns a corrected copy of an RGB image
+        '''
+        if self._dither == "none":
+            return image.point(self.point_lut)
+        return Image.fromarray(self.apply_buffer(np.asarray(image)))
+
+    def apply_buffer(self, buffer, out = None):
+        '''
+        Corrects a (height, width, 3) uint8 frame buffer into out (a new array if not given) and returns it
+        '''
+        height, width = buffer.shape[:2]
+        table = self.table
+        if self._indices and next(iter(self._indices))[:2] != (height, width):
+            self._indices.clear() # The frame size changed, don't keep bases for old sizes around
+        phase = self.frame % BAYER_LEVELS if self._dither == "temporal" else 0
+        self.frame += 1
+        base = self._index_base(height, width, phase)
+
+        if self._scratch is None or self._scratch.shape != buffer.shape:
+            self._scratch = np.empty(buffer.shape, dtype = np.intp) # take() would convert any other index type into a temporary array
+        if out is None:
+            out = np.empty_like(buffer)
+        np.add(base, buffer, out = self._scratch)
+        np.take(table, self._scratch, out = out, mode = "clip") # clip avoids the buffered bounds checks, indices are always in range
+        return out
+
+class ColorCorrectedOutput(OutputBackend):
+
+    '''
+    Applies a ColorPipeline to every frame before passing it on to another output.
+
+    Settings can be changed while running (e.g. pipeline.brightness = 0.3); the tables are rebuilt
+    on the next frame. Frames are corrected into a preallocated buffer or image, so correction doesn't
+    allocate per frame, except for PIL canvases without dithering (or without numpy) which use Image.point.
+    Records color.apply_ms in stats.
+    '''
+
+    def __init__(self, output: OutputBackend, pipeline: ColorPipeline, *, stats: Stats = None):
+        self.output = output
+        self.pipeline = pipeline
+        self.stats = stats if stats is not None else Stats()
+        self._buffer = None
+        self._image = None
+
+    @property
+    def accepts_buffer(self):
+        return np is not None
+
+    def _pass_on(self, buffer):
+        if self.output.accepts_buffer:
+            self.output.show_buffer(buffer)
+            return
+        if self._image is None or self._image.size != (buffer.shape[1], buffer.shape[0]):
+            self._image = Image.new("RGB", (buffer.shape[1], buffer.shape[0]))
+        self._image.frombytes(buffer.data)
+        self.output.show(self._image)
+
+    def show(self, image: Image):
+        start = time.perf_counter()
+        if np is None or (self.pipeline.dither == "none" and not self.output.accepts_buffer):
+            corrected = self.pipeline.apply(image)
+            self.stats.record("color.apply_ms", (time.perf_counter() - start) * 1000)
+            self.output.show(corrected)
+            return
+        self.show_buffer(np.asarray(image), start = start)
+
+    def show_buffer(self, buffer, *, start: float = None):
+        start = time.perf_counter() if start is None else start
+        if self._buffer is None or self._buffer.shape != buffer.shape:
+            self._buffer = np.empty_like(buffer)
+        self.pipeline.apply_buffer(buffer, out = self._buffer)
+        self.stats.record("color.apply_ms", (time.perf_counter() - start) * 1000)
+        self._pass_on(self._buffer)
+
+    def close(self):
+        self.output.close()
@@ -0,0 +1,125 @@
+from PIL import Image
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+class PILCompositor():
+
+    '''
+    Composites plugin canvases onto the layout canvas with Image.paste.
+
+    Layouts call fill() and blit() for every damaged box and then finish() once per frame.
+    '''
+
+    buffer = None # No zero-copy frame buffer, outputs get the PIL canvas
+
+    def __init__(self, canvas: Image.Image):
+        self.canvas = canvas
+
+    def fill(self, box, color = (0, 0, 0)):
+        self.canvas.paste(color, box)
+
+    def blit(self, image: Image.Image, box, src_box, *, key = None, opaque = False):
+        '''
+        Draws the src_box part of image into box on the canvas, alpha blending RGBA images unless opaque is set.
+        key identifies where image came from (e.g. a (plugin, version) pair), compositors may use it to cache conversions.
+        '''
+        if src_box != (0, 0, image.width, image.height):
+            image = image.crop(src_box)
+        self.canvas.paste(image, box[:2], (image if image.mode == "RGBA" and not opaque else None))
+
+    def forget(self, owner):
+        pass
+
+    def finish(self) -> Image.Image:
+        return self.canvas
+
+class NumpyCompositor():
+
+    '''
+    Composites into a preallocated (height, width, 3) uint8 NumPy frame buffer with vectorized alpha blending.
+
+    Plugin canvases are converted to arrays once (RGBA ones premultiplied, ready for blending) and
+    reused for as long as the plugin keeps returning the same, unchanged image. The buffer is copied
+    into the layout's PIL canvas in place at the end of the frame, without allocating, and outputs
+    that can take a raw buffer are handed the array itself.
+    '''
+
+    def __init__(self, canvas: Image.Image):
+        if np is None:
+            raise ImportError("The numpy compositor requires numpy to be installed")
+        self.canvas = canvas
+        height, width = canvas.height, canvas.width
+        self.buffer = np.zeros((height, width, 3), dtype = np.uint8)
+        self._blend = np.empty((height, width, 3), dtype = np.uint16) # Scratch space, sliced down to the size of each blit
+        self._arrays: dict[object, tuple] = {} # owner -> (key, image, prepared arrays)
+
+    def _prepare(self, image: Image.Image):
+        '''
+        Returns (rgb, premultiplied, inverse_alpha). The last two are None for RGB images.
+        '''
+        array = np.asarray(image)
+        if image.mode == "RGB":
+            return array, None, None
+        alpha = array[..., 3:4].astype(np.uint16)
+        premultiplied = array[..., :3] * alpha
+        inverse_alpha = np.repeat(255 - alpha, 3, axis = 2)
+        return array[..., :3], premultiplied, inverse_alpha
+
+    def _arrays_for(self, image: Image.Image, key):
+        if key is None:
+            return self._prepare(image)
+        owner = key[0]
+        cached = self._arrays.get(owner)
+        if cached is not None and cached[0] == key and cached[1] is image:
+            return cached[2]
+        arrays = self._prepare(image)
+        self._arrays[owner] = (key, image, arrays)
+        return arrays
+
+    def fill(self, box, color = (0, 0, 0)):
+        self.buffer[max(box[1], 0):max(box[3], 0), max(box[0], 0):max(box[2], 0)] = color
+
+    def blit(self, image: Image.Image, box, src_box, *, key = None, opaque = False):
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA")
+            key = None
+        # Boxes may hang off the edge of the screen (e.g. debug borders)
+        x1, y1 = max(box[0], 0), max(box[1], 0)
+        x2, y2 = min(box[2], self.buffer.shape[1]), min(box[3], self.buffer.shape[0])
+        if x1 >= x2 or y1 >= y2:
+            return
+        sx, sy = src_box[0] + x1 - box[0], src_box[1] + y1 - box[1]
+        src = (slice(sy, sy + (y2 - y1)), slice(sx, sx + (x2 - x1)))
+
+        rgb, premultiplied, inverse_alpha = self._arrays_for(image, key)
+        dst = self.buffer[y1:y2, x1:x2]
+        if premultiplied is None or opaque:
+            dst[...] = rgb[src]
+            return
+
+        # dst = (src * alpha + dst * (255 - alpha) + 127) // 255, in place on a scratch buffer
+        blend = self._blend[:y2 - y1, :x2 - x1]
+        np.copyto(blend, dst)
+        np.multiply(blend, inverse_alpha[src], out = blend)
+        np.add(blend, premultiplied[src], out = blend)
+        np.add(blend, 127, out = blend)
+        np.floor_divide(blend, 255, out = blend)
+        np.copyto(dst, blend, casting = "unsafe")
+
+    def forget(self, owner):
+        '''
+        Drops cached arrays for a plugin that is no longer part of the layout
+        '''
+        self._arrays.pop(owner, None)
+
+    def finish(self) -> Image.Image:
+        self.canvas.frombytes(self.buffer) # Decodes into the existing image, no allocation
+        return self.canvas
+
+COMPOSITORS = {
+    "pil": PILCompositor,
+    "numpy": NumpyCompositor,
+}
@@ -0,0 +1,176 @@
+from common.playlist import Playlist
+from common.plugin import PluginBase
+from common.sandbox import SandboxedPlugin
+
+from importlib import import_module
+import asyncio
+import json
+import os
+
+try:
+    import tomllib
+except ImportError: # Python < 3.11
+    try:
+        import tomli as tomllib
+    except ImportError: # Only JSON configs can be read
+        tomllib = None
+
+class LayoutConfig():
+
+    '''
+    Builds layouts and a playlist from a TOML or JSON file, and rebuilds them whenever the file changes.
+
+        [[layouts]]
+        name = "main"
+        duration = 30                   # Seconds in the playlist rotation
+        schedule = "* 8-22 * * *"       # Optional, see common.playlist.CronRule
+        transition = "crossfade"        # Optional, see common.transitions
+
+        [[layouts.plugins]]
+        module = "modules.image"        # Imported on first use, like Layout.add_plugin
+        id = "album"                    # Optional. Plugins with the same id share an instance across layouts
+        x = 0
+        y = 0
+        width = 64
+        height = 64
+        z_index = 0
+        sandbox = false                 # Optional. Run the plugin in its own process, see common.sandbox
+        options = { images = ["assets/images/"], hold_time = 3 } # Passed to the module's setup()
+
+    On reload, plugins whose module and options didn't change keep their instance (and state),
+    so moving a plugin around or editing another layout doesn't restart it. Layouts and the
+    playlist are replaced as a whole and the previous layouts are unregistered.
+    A file that fails to load or build is reported and the running config is kept.
+    '''
+
+    def __init__(self, display_manager, path: str, *, poll_interval: float = 1):
+        self.display_manager = display_manager
+        self.path = path
+        self.poll_interval = poll_interval
+        self.layouts: dict[str, object] = {}
+        self.playlist: Playlist = None
+        self._plugins: dict[str, tuple[str, dict, PluginBase]] = {} # key -> (module, options, instance)
+        self._mtime = None
+        self._watch_task = None
+
+    def read(self) -> dict:
+        '''
+        Parses the config file
+        '''
+        with open(self.path, "rb") as f:
+            if os.path.splitext(self.path)[1].lower() == ".json":
+                return json.load(f)
+            if tomllib is None:
+                raise RuntimeError("Reading TOML configs requires Python 3.11 or newer or the tomli package, use a .json config instead")
+            return tomllib.load(f)
+
+    def _plugin_for(self, key: str, module: str, options: dict, size: tuple[int, int], sandbox: bool, plugins: dict) -> PluginBase:
+        '''
+        Returns the existing instance for key if its module and options are unchanged, otherwise sets up a new one
+        '''
+        if key in plugins:
+            return plugins[key][2]
+        previous = self._plugins.get(key)
+        if previous is not None and previous[0] == module and previous[1] == options and isinstance(previous[2], SandboxedPlugin) == sandbox:
+            instance = previous[2]
+        elif sandbox:
+            instance = SandboxedPlugin(module, size, self.display_manager, **options)
+        else:
+            instance = import_module(module).setup(size, self.display_manager, **options)
+        plugins[key] = (module, options, instance)
+        return instance
+
+    async def build(self, config: dict):
+        '''
+        Creates (and registers) the layouts and playlist described by config.
+        Returns (layouts, playlist, plugins) without touching what is currently shown.
+        '''
+        display_manager = self.display_manager
+        layouts = {}
+        plugins = {}
+        playlist = Playlist(display_manager, **config.get("playlist", {}))
+        try:
+            for index, layout_config in enumerate(config.get("layouts", [])):
+                name = layout_config.get("name", f"layout{index}")
+                if name in layouts:
+                    raise ValueError(f"Layout {name!r} is defined twice")
+                layout = display_manager.new_layout()
+                layouts[name] = layout
+                for plugin_index, plugin_config in enumerate(layout_config.get("plugins", [])):
+                    if "module" not in plugin_config:
+                        raise ValueError(f"Plugin {plugin_index} in layout {name!r} has no module")
+                    width, height = plugin_config["width"], plugin_config["height"]
+                    key = plugin_config.get("id", f"{name}/{plugin_index}")
+                    instance = self._plugin_for(key, plugin_config["module"], plugin_config.get("options", {}), (width, height),
+                                                 plugin_config.get("sandbox", False), plugins)
+                    layout.add_plugin(instance, width = width, height = height, x = plugin_config.get("x", 0),
+                                      y = plugin_config.get("y", 0), z_index = plugin_config.get("z_index", 0))
+                playlist.add(layout, duration = layout_config.get("duration", 10), schedule = layout_config.get("schedule"),
+                             transition = layout_config.get("transition"), transition_duration = layout_config.get("transition_duration", 0.5))
+        except Exception:
+            for layout in layouts.values():
+                display_manager.layouts.remove(layout) # Never shown, so there's nothing else to clean up
+            reused = {entry[2] for entry in self._plugins.values()}
+            created = [entry[2] for entry in plugins.values() if entry[2] not in reused]
+            for plugin in created:
+                plugin.cancel_ticks()
+            await asyncio.gather(*(plugin.teardown() for plugin in created), return_exceptions = True)
+            raise
+        return layouts, playlist, plugins
+
+    async def reload(self):
+        '''
+        Loads the config file and switches over to it
+        '''
+        self._mtime = os.stat(self.path).st_mtime
+        layouts, playlist, plugins = await self.build(self.read())
+
+        display_manager = self.display_manager
+        if self.playlist is not None:
+            await self.playlist.stop()
+        first = playlist.next_index()
+        if first is not None:
+            entry = playlist.entries[first]
+            await entry.layout.prewarm()
+            await display_manager.switch_layout(entry.layout, transition = entry.transition, duration = entry.transition_duration)
+
+        previous_layouts = [layout for layout in self.layouts.values() if layout is not display_manager.current_layout]
+        self.layouts, self.playlist, self._plugins = layouts, playlist, plugins
+        for layout in previous_layouts:
+            await display_manager.unregister_layout(layout) # Tears down plugins that weren't carried over
+        playlist.start()
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except OSError:
+                continue # Probably being replaced by an editor
+            if mtime == self._mtime:
+                continue
+            try:
+                await self.reload()
+                print(f"Reloaded {self.path}")
+            except Exception as e:
+                self._mtime = mtime # Don't retry until the file changes again
+                print(f"Warning: could not reload {self.path}, keeping the current layouts:", e)
+
+    def watch(self):
+        '''
+        Starts polling the config file for changes. Must be called from within a running event loop.
+        '''
+        if self._watch_task is None or self._watch_task.done():
+            self._watch_task = asyncio.create_task(self._watch())
+        return self._watch_task
+
+    async def stop(self):
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            try:
+                await self._watch_task
+            except asyncio.CancelledError:
+                pass
+            self._watch_task = None
+        if self.playlist is not None:
+            await self.playlist.stop()
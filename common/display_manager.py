@@ -1,17 +1,60 @@
 from common.layout import Layout
+from common.exc import LayoutNotRegistered, LayoutInUse
 from common.plugin import PluginBase
+from common.output import OutputBackend, MatrixOutput
+from common.stats import Stats
+from common.ticker import Ticker
+from common.transitions import TRANSITIONS, render_transition
 
+from concurrent.futures import ThreadPoolExecutor
 import asyncio
+import time
+
+RENDER_MODES = ("inline", "thread")
 
 class DisplayManager():
 
-    def __init__(self, matrix = None, *, width = 64, height = 64):
+    def __init__(self, matrix = None, *, output: OutputBackend = None, width = 64, height = 64, target_fps = 30, max_fps = 60, idle = True, render_mode = "inline", compositor = "pil"):
+        '''
+        Frames are pushed to output. If only a matrix is given, frames are pushed to it with SetImage.
+
+        render_mode selects where compositing and the (blocking) matrix update happen:
+        "inline" runs them on the event loop, "thread" runs them on a dedicated render thread
+        so that plugin I/O on the event loop is never stalled by a frame.
+
+        compositor is passed on to new layouts ("pil" or "numpy", see common.compositor).
+        '''
+        if render_mode not in RENDER_MODES:
+            raise ValueError(f"Unknown render mode {render_mode!r}, expected one of {RENDER_MODES}")
+
         self.matrix = matrix
+        if output is None and matrix is not None:
+            output = MatrixOutput(matrix)
+        self.output = output
         self._layouts: dict[Layout] = []
         self._screen_width = width
         self._screen_height = height
         self._current_layout = None
 
+        # Frame scheduler state (see start_scheduler)
+        self.target_fps = target_fps
+        self.max_fps = max_fps
+        self.idle = idle # Only render when something asked for a frame
+        self._dirty_event = asyncio.Event()
+        self._draw_lock = asyncio.Lock() # Only one frame may be in flight at a time
+        self._scheduler_task = None
+
+        self.stats = Stats() # Frame and plugin timings, see common.stats
+        self._last_frame_time = None
+        self.ticker = Ticker(self) # Shared timer for plugins' periodic callbacks, see PluginBase.every
+
+        self.compositor = compositor
+        self.render_mode = render_mode
+        self._executor = None
+        if render_mode == "thread":
+            # A single worker keeps frames in order and means the layout canvas is never touched by two threads at once
+            self._executor = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = "ledbox-render")
+
     @property
     def layouts(cls):
         return cls._layouts
@@ -20,36 +63,149 @@ class DisplayManager():
     def current_layout(cls):
         return cls._current_layout
 
+    @property
+    def frame_interval(self):
+        '''
+        Minimum time between two scheduled frames, in seconds
+        '''
+        fps = min(self.target_fps, self.max_fps) if self.max_fps else self.target_fps
+        return 1 / fps
+
+    @property
+    def scheduler_running(self):
+        return self._scheduler_task is not None and not self._scheduler_task.done()
+
+    def start_scheduler(self):
+        '''
+        Starts the frame scheduler. Must be called from within a running event loop.
+
+        While the scheduler is running, draw requests only mark the display as dirty.
+        Every request arriving within one frame interval is coalesced into a single
+        composite, and frames are paced to target_fps (capped by max_fps).
+        If idle is True, nothing is rendered until something asks for a frame.
+        '''
+        if self.scheduler_running:
+            return self._scheduler_task
+        self._scheduler_task = asyncio.create_task(self._scheduler_loop())
+        return self._scheduler_task
+
+    async def stop_scheduler(self):
+        if not self.scheduler_running:
+            return
+        self._scheduler_task.cancel()
+        try:
+            await self._scheduler_task
+        except asyncio.CancelledError:
+            pass
+        self._scheduler_task = None
+
+    def mark_dirty(self):
+        '''
+        Flags the display as needing a new frame. The scheduler picks this up on its next frame boundary.
+        '''
+        self._dirty_event.set()
+
+    async def _scheduler_loop(self):
+        loop = asyncio.get_running_loop()
+        next_frame = loop.time()
+        while True:
+            if self.idle:
+                await self._dirty_event.wait()
+
+            # Wait out the rest of the frame interval so that every request made in the meantime lands in this frame
+            delay = next_frame - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            self._dirty_event.clear()
+            if self._current_layout is not None:
+                try:
+                    await self.update_display()
+                except Exception as e:
+                    print("Warning: scheduled frame could not be drawn:", e)
+
+            # Don't try to catch up on missed frames, just start pacing again from now
+            next_frame = max(next_frame + self.frame_interval, loop.time())
+
     async def update_display(self, *, canvas = None):
         '''
         Updates the display. If the canvas parameter is left blank,
         a draw() call will be made on current layout.
         '''
+        async with self._draw_lock:
+            await self._render_frame(canvas = canvas)
+
+    async def _render_frame(self, *, canvas = None):
+        '''
+        Does the work of update_display(). Callers must hold _draw_lock.
+        '''
         if self._current_layout is None:
             raise Exception("No layout is currently selected")
 
-        if not canvas:
-            canvas = await self._current_layout.draw()
-        if self.matrix:
-            self.matrix.SetImage(canvas)
+        with self.stats.timer("frame.total_ms"):
+            if not canvas:
+                canvas = await self._current_layout.draw(executor = self._executor)
+            # Outputs that can take a raw frame buffer get the compositor's array instead of a PIL image
+            buffer = None
+            if self.output and self.output.accepts_buffer and canvas is self._current_layout.canvas:
+                buffer = self._current_layout.frame_buffer
+            await self._output_frame(canvas, buffer)
 
         await self.current_layout.screen_updated()
 
-    async def switch_layout(self, layout):
+    async def _output_frame(self, canvas, buffer = None):
+        '''
+        Pushes a finished frame to the output (on the render thread in thread mode) and records frame timing
+        '''
+        if self.output:
+            if self._executor is not None:
+                await asyncio.get_running_loop().run_in_executor(self._executor, self._show, canvas, buffer)
+            else:
+                self._show(canvas, buffer)
+
+        now = time.perf_counter()
+        if self._last_frame_time is not None:
+            self.stats.record("frame.interval_ms", (now - self._last_frame_time) * 1000)
+        self._last_frame_time = now
+        self.stats.increment("frame.count")
+
+    def _show(self, canvas, buffer = None):
+        with self.stats.timer("output.show_ms"):
+            if buffer is not None:
+                self.output.show_buffer(buffer)
+            else:
+                self.output.show(canvas)
+
+    async def switch_layout(self, layout, *, transition: str = None, duration: float = 0.5):
+        '''
+        Makes layout the visible layout.
+
+        transition animates the change ("crossfade", "slide" or "wipe", see common.transitions) over duration seconds.
+        Plugin activation callbacks run before the transition starts, and plugins keep running while it plays;
+        draw requests made in the meantime are picked up by the first frame after it.
+        '''
         if not layout in self._layouts:
             raise Exception("Layout must be properly registered in order to switch to it")
+        if transition is not None and transition not in TRANSITIONS:
+            raise ValueError(f"Unknown transition {transition!r}, expected one of {tuple(TRANSITIONS)}")
         
         # Callbacks on layout member plugins
         shared_plugins = []
         deactivating_plugins = []
         if self._current_layout is not None:
-            shared_plugins = [plugin for plugin in self.current_layout.plugins if plugin in layout.plugins] # Plugins shared by both layouts
+            next_plugins = set(layout.plugins)
+            shared_plugins = [plugin for plugin in self.current_layout.plugins if plugin in next_plugins] # Plugins shared by both layouts
             
-            deactivating_plugins = [plugin for plugin in self.current_layout.plugins if plugin not in shared_plugins]
+            deactivating_plugins = [plugin for plugin in self.current_layout.plugins if plugin not in next_plugins]
+            for plugin in deactivating_plugins:
+                plugin.pause_ticks()
             deactivation_tasks = [plugin.deactivated() for plugin in deactivating_plugins]
             await asyncio.gather(*deactivation_tasks, return_exceptions = True)
 
-        activating_plugins = [plugin for plugin in layout.plugins if plugin not in shared_plugins]
+        shared = set(shared_plugins)
+        activating_plugins = [plugin for plugin in layout.plugins if plugin not in shared]
+        for plugin in activating_plugins:
+            plugin.resume_ticks()
         activation_tasks = [plugin.activated() for plugin in activating_plugins]
         await asyncio.gather(*activation_tasks, return_exceptions = True)
 
@@ -60,11 +216,45 @@ class DisplayManager():
         if self._current_layout is not None:
             await self._current_layout.deactivated(layout)
 
-        previous_layout = self.current_layout
-        self._current_layout = layout # This will be the same layout instance as in self._layouts because of the guards above
-        await layout.handle_plugin_changeover()
-        await layout.activated(previous_layout)
-        await self.update_display()
+        # Hold the draw lock so the scheduler can't draw the new layout before it has been resized
+        async with self._draw_lock:
+            previous_layout = self.current_layout
+            self._current_layout = layout # This will be the same layout instance as in self._layouts because of the guards above
+            await layout.handle_plugin_changeover()
+            await layout.activated(previous_layout)
+            if transition is not None and previous_layout is not None and previous_layout is not layout:
+                await self._play_transition(transition, previous_layout.canvas, duration)
+            await self._render_frame()
+
+    async def _play_transition(self, name, before, duration):
+        '''
+        Captures the first frame of the current layout, precomputes every frame of the transition
+        from before to it off the event loop, then streams them to the output at frame_interval.
+        Callers must hold _draw_lock.
+        '''
+        loop = asyncio.get_running_loop()
+        with self.stats.timer("transition.prepare_ms"):
+            before = before.copy() # The old layout's last frame, before anything else touches it
+            after = await self._current_layout.draw(executor = self._executor)
+            frame_count = max(1, round(duration / self.frame_interval) - 1)
+            images = not (self.output and self.output.accepts_buffer)
+            frames = await loop.run_in_executor(self._executor, render_transition, name, before, after, frame_count, images)
+
+        # Frames are due at fixed times from the start rather than sleeping a fixed amount between them,
+        # so the transition doesn't drift. Frames that are already late are dropped to keep its duration.
+        start = loop.time()
+        for index, (buffer, image) in enumerate(frames):
+            due = start + index * self.frame_interval
+            delay = due - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elif -delay > self.frame_interval and index + 1 < len(frames):
+                self.stats.increment("transition.dropped_frames")
+                continue
+            self.stats.record("transition.lateness_ms", max(0, -delay) * 1000)
+            with self.stats.timer("frame.total_ms"):
+                await self._output_frame(image, buffer if image is None else None)
+        self.stats.increment("transition.count")
         
 
     def new_layout(self, layout_cls = None):
@@ -76,17 +266,42 @@ class DisplayManager():
         if not layout_cls:
             layout_cls = Layout
 
-        l = layout_cls(self, screen_width = self._screen_width, screen_height = self._screen_height)
+        l = layout_cls(self, screen_width = self._screen_width, screen_height = self._screen_height, compositor = self.compositor)
         self._layouts.append(l)
         return l
 
+    async def unregister_layout(self, layout, *, teardown = True):
+        '''
+        Removes a layout. The current layout can't be removed, switch away from it first.
+
+        With teardown, plugins that aren't part of any other registered layout are torn down.
+        '''
+        if layout not in self._layouts:
+            raise LayoutNotRegistered("Layout is not registered with this display manager")
+        if layout is self._current_layout:
+            raise LayoutInUse("The current layout can't be unregistered")
+
+        self._layouts.remove(layout)
+        if teardown:
+            remaining = {plugin for other in self._layouts for plugin in other.plugins}
+            orphans = [plugin for plugin in layout.plugins if plugin not in remaining]
+            for plugin in orphans:
+                plugin.cancel_ticks()
+            await asyncio.gather(*(plugin.teardown() for plugin in orphans), return_exceptions = True)
+
     async def request_immediate_draw(self):
         '''
         A function for plugins to directly ask for their draw() function to be called.
 
         Intended for immediate-mode style applications
+
+        If the frame scheduler is running, the request is coalesced into the next scheduled frame instead.
         '''
-        canvas = await self._current_layout.draw()
+        if self.scheduler_running:
+            self.mark_dirty()
+            return True
+
+        canvas = await self._current_layout.draw(executor = self._executor)
         if canvas:
             await self.update_display(canvas = canvas)
             return True
@@ -97,7 +312,13 @@ class DisplayManager():
         A function for plugins to directly ask for their draw() function to be called.
         Ignores z-index and draws plugin on top. In most cases you will want to use
         request_immediate_draw()
+
+        If the frame scheduler is running, the plugin is drawn as part of the next scheduled frame (respecting z-index).
         '''
+        if self.scheduler_running:
+            self.mark_dirty()
+            return True
+
         canvas = await self._current_layout.plugin_draw_requested(plugin)
         if canvas:
             await self.update_display(canvas = canvas)
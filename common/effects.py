@@ -0,0 +1,89 @@
+from common.plugin import PluginBase
+
+import numpy as np
+import time
+
+def gradient_palette(stops: list[tuple[int, tuple[int, int, int]]]) -> np.ndarray:
+    '''
+    Builds a (256, 3) uint8 palette by interpolating between (index, color) stops
+    '''
+    indices = [index for index, _ in stops]
+    colors = np.array([color for _, color in stops], dtype = np.float32)
+    positions = np.arange(256)
+    return np.stack([np.interp(positions, indices, colors[:, channel]) for channel in range(3)], axis = 1).round().astype(np.uint8)
+
+def palette_indices(height: int, width: int) -> np.ndarray:
+    '''
+    A (height, width) array of palette indices for palette_lookup(). They are intp because take() converts
+    indices of any other type into a temporary array on every call.
+    '''
+    return np.zeros((height, width), dtype = np.intp)
+
+def palette_lookup(palette: np.ndarray, indices: np.ndarray, out: np.ndarray) -> np.ndarray:
+    '''
+    Colors indices (from palette_indices()) with palette into out, a (height, width, 3) uint8 array.
+    Indices must be in range: mode = "clip" skips the buffered bounds check that the default mode does.
+    '''
+    return np.take(palette, indices, axis = 0, out = out, mode = "clip")
+
+class EffectPlugin(PluginBase):
+
+    '''
+    A base class for procedural effects that compute every frame with NumPy.
+
+    Subclasses allocate their buffers in allocate() (called again whenever the plugin is resized) and
+    compute each frame into self.frame, a (height, width, 3) uint8 array, in render(). render() should only
+    use whole-array operations writing into preallocated arrays (out=), so that a frame doesn't allocate.
+
+    The effect advances fps times a second while visible, through a tick calling advance(), which invalidates
+    the plugin; the frame is computed by draw(), so only frames that are actually composited are computed.
+    With fps = 0 the effect only advances when something else invalidates it.
+    '''
+
+    opaque = True
+    cache_output = True
+    surface_mode = "RGB"
+
+    def __init__(self, dimensions, display_manager, *, fps: float = 60, seed: int = None):
+        super().__init__(dimensions, display_manager)
+        self.rng = np.random.default_rng(seed)
+        self.frame: np.ndarray = None
+        self._start = time.monotonic()
+        self._last_render = None
+        self.allocate(*dimensions)
+        self._tick = self.every(1 / fps, self.advance) if fps else None
+
+    def allocate(self, width: int, height: int):
+        '''
+        (Re)allocates the buffers for a width x height effect. Subclasses should call super().allocate().
+        '''
+        self.frame = np.zeros((height, width, 3), dtype = np.uint8)
+
+    def advance(self):
+        '''
+        Called fps times a second while visible. Subclasses may override this (also with a coroutine) to prepare the next frame.
+        '''
+        self.invalidate()
+
+    def render(self, t: float, dt: float):
+        '''
+        Computes the next frame into self.frame. t is the time since the effect started and dt the time since the last frame, in seconds.
+        '''
+        raise NotImplementedError
+
+    async def draw(self):
+        now = time.monotonic()
+        dt = now - self._last_render if self._last_render is not None else 0
+        self._last_render = now
+        self.render(now - self._start, min(dt, 0.1)) # Don't jump ahead after being hidden for a while
+        surface = self.surface
+        surface.frombytes(self.frame.data)
+        return surface
+
+    async def resize_requested(self, width, height):
+        if (width, height) != self._canvas_size:
+            self.allocate(width, height)
+        await super().resize_requested(width, height)
+
+    async def deactivated(self):
+        self._last_render = None
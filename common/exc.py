@@ -1,3 +1,5 @@
 
 class PluginAlreadyRegistered(Exception): pass
-class PluginNotRegistered(Exception): pass
\ No newline at end of file
+class PluginNotRegistered(Exception): pass
+class LayoutNotRegistered(Exception): pass
+class LayoutInUse(Exception): pass
@@ -0,0 +1,69 @@
+from PIL import Image
+
+import time
+
+class FakeFrameCanvas():
+
+    '''
+    Emulates rgbmatrix's FrameCanvas. Pixels are kept in an RGB Image.
+    '''
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.brightness = 100
+        self.pwmBits = 11
+        self.image = Image.new("RGB", (width, height))
+
+    def SetPixel(self, x, y, red, green, blue):
+        if 0 <= x < self.width and 0 <= y < self.height:
+            self.image.putpixel((x, y), (red, green, blue))
+
+    def SetImage(self, image, offset_x = 0, offset_y = 0, unsafe = True):
+        if image.mode != "RGB":
+            raise Exception("Currently, only RGB mode is supported for SetImage(). Please create images with mode 'RGB' or convert first with image = image.convert('RGB').")
+        self.image.paste(image, (offset_x, offset_y))
+
+    def Clear(self):
+        self.image.paste( (0, 0, 0), (0, 0, self.width, self.height))
+
+    def Fill(self, red, green, blue):
+        self.image.paste( (red, green, blue), (0, 0, self.width, self.height))
+
+class FakeRGBMatrix(FakeFrameCanvas):
+
+    '''
+    A drop-in stand-in for rgbmatrix.RGBMatrix for machines without a HAT.
+
+    Supports SetImage, CreateFrameCanvas and SwapOnVSync. If refresh_rate is given,
+    SwapOnVSync blocks until the next emulated vertical sync like the real thing does.
+    The frame currently "on the panel" can be read with snapshot().
+    '''
+
+    def __init__(self, *, width = 64, height = 64, refresh_rate: float = None):
+        super().__init__(width, height)
+        self.refresh_rate = refresh_rate
+        self.canvases_created = 0
+        self.swaps = 0
+        self._front = self # Whatever is being displayed, starts out as the matrix itself like in rgbmatrix
+        self._epoch = time.monotonic()
+
+    def CreateFrameCanvas(self):
+        self.canvases_created += 1
+        return FakeFrameCanvas(self.width, self.height)
+
+    def SwapOnVSync(self, canvas, framerate_fraction = 1):
+        if self.refresh_rate:
+            period = framerate_fraction / self.refresh_rate
+            elapsed = time.monotonic() - self._epoch
+            time.sleep(period - (elapsed % period))
+        previous = self._front
+        self._front = canvas
+        self.swaps += 1
+        return previous
+
+    def snapshot(self) -> Image:
+        '''
+        Returns a copy of what the panel is showing
+        '''
+        return self._front.image.copy()
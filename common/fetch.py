@@ -0,0 +1,166 @@
+from common.imaging import ImageCache, decode_executor, load_image
+from PIL import Image
+
+import aiohttp
+import asyncio
+import hashlib
+import json
+import os
+
+class ImageFetcher():
+
+    '''
+    Downloads images over HTTP for plugins.
+
+    One pooled aiohttp session is shared by every request. Response bodies are streamed to
+    a disk cache in chunks and revalidated with ETag/Last-Modified conditional requests, so an
+    unchanged image costs a 304 instead of a download and a decode. Decoded images, scaled to the
+    size asked for, are cached both in memory and on disk. Decoding happens off the event loop.
+
+    If a request fails and a cached copy exists, the cached copy is returned.
+    '''
+
+    def __init__(self, *, cache_dir: str = "cache/http", memory_bytes: int = 8 * 1024 * 1024, chunk_size: int = 64 * 1024, limit_per_host: int = 4, timeout: float = 30):
+        self.cache_dir = cache_dir
+        self.chunk_size = chunk_size
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self._memory = ImageCache(memory_bytes) # (url, size) -> Image
+        self._session: aiohttp.ClientSession = None
+        self._locks: dict[str, asyncio.Lock] = {}
+        self.requests = 0
+        self.not_modified = 0
+
+    async def session(self) -> aiohttp.ClientSession:
+        '''
+        Returns the shared session, creating it on first use
+        '''
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit_per_host = self.limit_per_host)
+            self._session = aiohttp.ClientSession(connector = connector, timeout = aiohttp.ClientTimeout(total = self.timeout))
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _paths(self, url: str) -> tuple[str, str]:
+        '''
+        Returns the (body, metadata) cache paths for url
+        '''
+        key = os.path.join(self.cache_dir, hashlib.sha1(url.encode()).hexdigest())
+        return key + ".body", key + ".json"
+
+    def _scaled_path(self, url: str, size: tuple[int, int]) -> str:
+        return f"{self._paths(url)[0][:-len('.body')]}-{size[0]}x{size[1]}.png"
+
+    def _forget_scaled(self, url: str):
+        '''
+        Drops every decoded and scaled copy of url, in memory and on disk, after its body changed.
+        They are cached per size, but whether the body changed is only known to the first caller to fetch it.
+        '''
+        self._memory.discard(lambda key: key[0] == url)
+        prefix = os.path.basename(self._paths(url)[0][:-len(".body")]) + "-"
+        for name in os.listdir(self.cache_dir):
+            if name.startswith(prefix) and name.endswith(".png"):
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except OSError:
+                    pass
+
+    def _read_meta(self, url: str) -> dict:
+        body_path, meta_path = self._paths(url)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if not os.path.exists(body_path):
+            return {}
+        return meta
+
+    async def fetch(self, url: str) -> tuple[str, bool]:
+        '''
+        Makes sure the latest version of url is in the disk cache.
+        Returns the path of the cached body and whether it changed since the last fetch.
+        '''
+        lock = self._locks.setdefault(url, asyncio.Lock())
+        async with lock:
+            body_path, meta_path = self._paths(url)
+            meta = self._read_meta(url)
+            headers = {}
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+            session = await self.session()
+            self.requests += 1
+            try:
+                async with session.get(url, headers = headers) as resp:
+                    if resp.status == 304 and meta:
+                        self.not_modified += 1
+                        return body_path, False
+                    resp.raise_for_status()
+
+                    os.makedirs(self.cache_dir, exist_ok = True)
+                    partial_path = body_path + ".part"
+                    with open(partial_path, "wb") as f:
+                        async for chunk in resp.content.iter_chunked(self.chunk_size):
+                            f.write(chunk)
+                    os.replace(partial_path, body_path)
+                    self._forget_scaled(url)
+
+                    meta = {"url": url, "etag": resp.headers.get("ETag"), "last_modified": resp.headers.get("Last-Modified")}
+                    with open(meta_path, "w") as f:
+                        json.dump(meta, f)
+                    return body_path, True
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if not meta:
+                    raise
+                print(f"Warning: could not refresh {url}, using the cached copy:", e)
+                return body_path, False
+
+    async def fetch_image(self, url: str, size: tuple[int, int] = None) -> Image.Image:
+        '''
+        Returns the image at url as RGBA, scaled to size if given.
+
+        The same Image instance is returned for as long as the remote image doesn't change,
+        so callers can cheaply tell whether they got something new.
+        '''
+        body_path, changed = await self.fetch(url)
+        key = (url, tuple(size) if size else None)
+        loop = asyncio.get_running_loop()
+
+        if not changed:
+            image = self._memory.get(key)
+            if image is not None:
+                return image
+            if size and os.path.exists(self._scaled_path(url, size)):
+                image = await loop.run_in_executor(decode_executor, load_image, self._scaled_path(url, size), size)
+                self._memory.put(key, image)
+                return image
+
+        image = await loop.run_in_executor(decode_executor, self._decode, body_path, url, size)
+        self._memory.put(key, image)
+        return image
+
+    def _decode(self, body_path, url, size):
+        if size is None:
+            with Image.open(body_path) as image:
+                return image.convert("RGBA")
+        image = load_image(body_path, size)
+        image.save(self._scaled_path(url, size))
+        return image
+
+_shared_fetcher = None
+
+def shared_fetcher() -> ImageFetcher:
+    '''
+    Returns the fetcher shared by all plugins in this process
+    '''
+    global _shared_fetcher
+    if _shared_fetcher is None:
+        _shared_fetcher = ImageFetcher()
+    return _shared_fetcher
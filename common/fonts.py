@@ -0,0 +1,98 @@
+from PIL import Image, ImageFont, ImageDraw
+from collections import OrderedDict
+
+import threading
+
+DEFAULT_FONT = "assets/fonts/unscii-8-alt.pil"
+
+_fonts: dict[str, ImageFont.ImageFont] = {}
+_fonts_lock = threading.Lock()
+
+def get_font(path: str = DEFAULT_FONT) -> ImageFont.ImageFont:
+    '''
+    Returns the bitmap font at path, loading it from disk only the first time it is asked for
+    '''
+    font = _fonts.get(path)
+    if font is None:
+        with _fonts_lock:
+            font = _fonts.get(path)
+            if font is None:
+                font = _fonts[path] = ImageFont.load(path)
+    return font
+
+class GlyphAtlas():
+
+    '''
+    Caches rasterized glyphs per (font, color) so drawing text becomes a series of bitmap blits.
+
+    Glyphs are kept in least-recently-used order and the oldest ones are evicted once
+    more than max_glyphs are cached. Only PIL bitmap fonts (assets/fonts/*.pil) are supported.
+    '''
+
+    def __init__(self, max_glyphs: int = 2048):
+        self.max_glyphs = max_glyphs
+        self._glyphs: OrderedDict[tuple, Image.Image] = OrderedDict()
+        self._lock = threading.Lock() # Text may be drawn from the render thread as well as the event loop
+        self.hits = 0
+        self.misses = 0
+
+    def glyph(self, char: str, *, font: str = DEFAULT_FONT, fill = (255, 255, 255)) -> Image.Image:
+        '''
+        Returns the RGBA bitmap of a single character. The image is shared, do not draw on it.
+        '''
+        key = (font, fill, char)
+        with self._lock:
+            glyph = self._glyphs.get(key)
+            if glyph is not None:
+                self._glyphs.move_to_end(key)
+                self.hits += 1
+                return glyph
+
+            self.misses += 1
+            pil_font = get_font(font)
+            glyph = Image.new("RGBA", pil_font.getbbox(char)[2:])
+            ImageDraw.Draw(glyph).text((0, 0), char, fill = fill, font = pil_font)
+            self._glyphs[key] = glyph
+            if len(self._glyphs) > self.max_glyphs:
+                self._glyphs.popitem(last = False)
+            return glyph
+
+    def line_height(self, font: str = DEFAULT_FONT, spacing: int = 4) -> int:
+        '''
+        Distance between two lines of multiline text, matching ImageDraw.multiline_text
+        '''
+        return get_font(font).getbbox("A")[3] + spacing
+
+    def text_size(self, text: str, *, font: str = DEFAULT_FONT, spacing: int = 4) -> tuple[int, int]:
+        '''
+        Returns the (width, height) text would take up when drawn with draw_text
+        '''
+        pil_font = get_font(font)
+        lines = text.split("\n")
+        width = max(pil_font.getbbox(line)[2] if line else 0 for line in lines)
+        height = pil_font.getbbox(lines[-1] or "A")[3] + self.line_height(font, spacing) * (len(lines) - 1)
+        return (width, height)
+
+    def draw_text(self, canvas: Image.Image, xy: tuple[int, int], text: str, *, font: str = DEFAULT_FONT, fill = (255, 255, 255), spacing: int = 4):
+        '''
+        Draws text onto canvas with its top left corner at xy. Newlines start a new line.
+        '''
+        x, y = xy
+        line_height = self.line_height(font, spacing)
+        for line in text.split("\n"):
+            cur_x = x
+            for char in line:
+                glyph = self.glyph(char, font = font, fill = fill)
+                canvas.paste(glyph, (cur_x, y), glyph)
+                cur_x += glyph.width
+            y += line_height
+
+    def render_text(self, text: str, *, font: str = DEFAULT_FONT, fill = (255, 255, 255), spacing: int = 4) -> Image.Image:
+        '''
+        Returns a new transparent RGBA image just big enough to hold text
+        '''
+        canvas = Image.new("RGBA", self.text_size(text, font = font, spacing = spacing))
+        self.draw_text(canvas, (0, 0), text, font = font, fill = fill, spacing = spacing)
+        return canvas
+
+atlas = GlyphAtlas() # Shared by every plugin in the process
@@ -0,0 +1,84 @@
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+
+# Image decoding and scaling for plugins happens here so it never blocks the event loop.
+# One worker keeps decodes from competing with each other (and the render thread) for the Pi's cores.
+decode_executor = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = "ledbox-decode")
+
+def fit_image(image: Image.Image, size: tuple[int, int], *, resample = Image.Resampling.LANCZOS) -> Image.Image:
+    '''
+    Returns a copy of image converted to RGBA and scaled to size. Images already the right size are only converted.
+    '''
+    if image.mode != "RGBA":
+        image = image.convert("RGBA") # Before scaling, palette images can only be scaled with nearest neighbour
+    elif image.size == tuple(size):
+        return image.copy()
+    if image.size != tuple(size):
+        image = image.resize(size, resample)
+    return image
+
+def image_bytes(image: Image.Image) -> int:
+    '''
+    Approximate memory taken by an image's pixels
+    '''
+    return image.width * image.height * len(image.getbands())
+
+class ImageCache():
+
+    '''
+    A least-recently-used cache of decoded images bounded by the memory their pixels take up.
+    '''
+
+    def __init__(self, max_bytes: int = 8 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._images: OrderedDict[object, Image.Image] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key):
+        return key in self._images
+
+    def __len__(self):
+        return len(self._images)
+
+    def get(self, key) -> Image.Image:
+        image = self._images.get(key)
+        if image is None:
+            self.misses += 1
+            return None
+        self._images.move_to_end(key)
+        self.hits += 1
+        return image
+
+    def put(self, key, image: Image.Image):
+        if key in self._images:
+            self.bytes -= image_bytes(self._images.pop(key))
+        self._images[key] = image
+        self.bytes += image_bytes(image)
+        # Always keep the newest image, even if it alone is over budget
+        while self.bytes > self.max_bytes and len(self._images) > 1:
+            _, evicted = self._images.popitem(last = False)
+            self.bytes -= image_bytes(evicted)
+
+    def discard(self, predicate):
+        '''
+        Removes every image whose key predicate(key) is true for
+        '''
+        for key in [key for key in self._images if predicate(key)]:
+            self.bytes -= image_bytes(self._images.pop(key))
+
+    def clear(self):
+        self._images.clear()
+        self.bytes = 0
+
+def load_image(path, size: tuple[int, int], *, resample = Image.Resampling.LANCZOS) -> Image.Image:
+    '''
+    Decodes the image at path (a filename or file object) straight to an RGBA image of the given size.
+    JPEGs are decoded at a reduced scale when they are much larger than size, which saves most of the work.
+    Blocking, run it in decode_executor.
+    '''
+    with Image.open(path) as image:
+        image.draft("RGB", tuple(size)) # No-op for formats that can't be decoded at a smaller scale
+        return fit_image(image, size, resample = resample)
@@ -1,26 +1,65 @@
 from common.plugin import PluginBase
 from common.exc import PluginAlreadyRegistered, PluginNotRegistered
+from common.util import box_intersection, box_area, merge_boxes
+from common.spatial import SpatialIndex
+from common.compositor import COMPOSITORS
+from common.sandbox import SandboxedPlugin
 from PIL import Image
 
 from importlib import import_module
 import asyncio
+import bisect
+import itertools
 import random
+import time
 
 class Layout():
 
-    def __init__(self, display_manager, *, screen_width = 64, screen_height = 64):
+    def __init__(self, display_manager, *, screen_width = 64, screen_height = 64, compositor = "pil"):
         self._plugins: list[PluginBase] = []
         self._plugin_coordinates: dict[PluginBase, tuple(int, int, int, int)] = {}
         self._plugin_z_index: dict[PluginBase, int] = {}
+        self._z_order: list[tuple[int, int, PluginBase]] = [] # (z-index, insertion order, plugin) in draw order, kept sorted
+        self._z_keys: dict[PluginBase, tuple[int, int]] = {}
+        self._insertion_counter = itertools.count()
+        self._spatial = SpatialIndex() # Over _plugin_coordinates
+        self._occluded: set[PluginBase] = None # Cached until plugins move, see occluded_plugins()
         self._canvas = Image.new("RGB", (screen_width, screen_height))
+        self._compositor = COMPOSITORS[compositor](self._canvas) # "pil" or "numpy", see common.compositor
         self._visible = False
+        self._prewarmed = False # Set by prewarm(), cleared once the layout has been shown
         self._display_manager = display_manager
         self.debug_borders = False
+        self.draw_budget: float = None # Seconds all plugin draws get per frame. Defaults to half the display manager's frame interval.
+        self._draw_tasks: dict[PluginBase, asyncio.Task] = {} # Draws in flight, including ones that missed their frame
+        self._late_draws: set[PluginBase] = set()
+
+        # Damage tracking. Only the parts of the screen that changed since the last frame get recomposited.
+        self._composited: dict[PluginBase, tuple] = {} # (canvas, version, coords) of what was last composited for each plugin
+        self._pending_damage: list[tuple(int, int, int, int)] = []
+        self._full_redraw = True
+        self.last_damage_rects: list[tuple(int, int, int, int)] = []
+        self.last_damaged_area = 0 # Pixels recomposited during the last draw
 
     @property
     def plugins(cls):
         return cls._plugins
 
+    @property
+    def stats(self):
+        return self._display_manager.stats
+
+    @property
+    def canvas(self) -> Image:
+        return self._canvas
+
+    @property
+    def frame_buffer(self):
+        '''
+        The compositor's (height, width, 3) NumPy frame buffer holding the same pixels as canvas, or None
+        '''
+        return self._compositor.buffer
+
     def frame_requested(self) -> Image:
         '''
         Called when the parent DisplayManager asks for a frame
@@ -29,7 +68,7 @@ class Layout():
         return self._canvas
 
     # TODO: Maybe make plugin parameter a string and resolve to an import automatically?
-    def add_plugin(self, plugin: str | PluginBase, *, width: int, height:int, x:int = 0, y:int = 0, z_index:int = 0, **kwargs) -> PluginBase:
+    def add_plugin(self, plugin: str | PluginBase, *, width: int, height:int, x:int = 0, y:int = 0, z_index:int = 0, sandbox: bool = False, **kwargs) -> PluginBase:
         '''
         Registers a plugin.
 
@@ -38,90 +77,328 @@ class Layout():
         Instances of PluginBase can be directly registered.
         Useful if one instance of a plugin needs to appear in multiple layouts (same-layout instancing is not supported).
         You will have to manually create a canvas call the plugin's setup() if you do this.
+
+        With sandbox, a plugin given by its path runs in a separate worker process (see common.sandbox.SandboxedPlugin),
+        so a slow draw() can't hold up the event loop. kwargs must then be JSON serializable.
         '''
 
-        if isinstance(plugin, str):
+        if sandbox:
+            if not isinstance(plugin, str):
+                raise ValueError("Only plugins given by their module path can be sandboxed")
+            plugin_instance = SandboxedPlugin(plugin, (width, height), self._display_manager, **kwargs)
+        elif isinstance(plugin, str):
             plugin_module = import_module(plugin)
             plugin_instance = plugin_module.setup((width, height), self._display_manager, **kwargs)
         elif isinstance(plugin, PluginBase):
             plugin_instance = plugin
 
-        if plugin_instance in self._plugins:
+        if plugin_instance in self._plugin_coordinates:
             raise PluginAlreadyRegistered("Plugin has already been added to this layout")
 
-        # TODO: Check for overlap
-
+        # Overlapping plugins are fine, they are drawn in z-index order
         self._plugins.append(plugin_instance)
-        self._plugin_coordinates[plugin_instance] = (x, y, x + width, y + height)
-        self._plugin_z_index[plugin_instance] = z_index
+        self._set_plugin_box(plugin_instance, (x, y, x + width, y + height))
+        self._set_z_index(plugin_instance, z_index)
+        if self._visible:
+            # Added to the layout on screen: it won't go through switch_layout(), so activate it here
+            plugin_instance.resume_ticks()
+            asyncio.create_task(self._activate_added_plugin(plugin_instance))
         return plugin_instance
 
+    async def _activate_added_plugin(self, plugin: PluginBase):
+        await self._resize_plugins([plugin])
+        try:
+            await plugin.activated()
+        except Exception as e:
+            print(f"Warning: {plugin} activated() raised an exception:", e)
+        if self._visible and plugin in self._plugin_coordinates:
+            await self._display_manager.request_immediate_draw()
+
     async def remove_plugin(self, plugin: PluginBase, *, redraw = True):
-        if not plugin in self._plugins:
+        if not plugin in self._plugin_coordinates:
             raise PluginNotRegistered("Plugin is not registered in this layout")
 
+        plugin.cancel_ticks()
         await plugin.teardown()
         self._plugins.remove(plugin)
         del self._plugin_coordinates[plugin]
-
-        if redraw:
-            self.draw()
+        del self._plugin_z_index[plugin]
+        self._z_order.pop(bisect.bisect_left(self._z_order, self._z_keys.pop(plugin)))
+        self._spatial.remove(plugin)
+        self._occluded = None
+        self._compositor.forget(plugin)
+        task = self._draw_tasks.pop(plugin, None)
+        if task is not None:
+            task.cancel()
+        self._late_draws.discard(plugin)
+        previous = self._composited.pop(plugin, None)
+        if previous is not None:
+            self._pending_damage.append(previous[2])
+
+        if redraw and self._visible:
+            await self._display_manager.request_immediate_draw()
 
     def get_plugin(self, plugin: PluginBase):
         '''
         Returns a plugin instance if it exists within the layout
         '''
-        if plugin not in self._plugins:
+        if plugin not in self._plugin_coordinates:
             return None
         return plugin
 
+    def _set_z_index(self, plugin: PluginBase, z_index: int):
+        '''
+        Moves a plugin within the z-order. Plugins sharing a z-index keep the order they were added in.
+        '''
+        key = self._z_keys.pop(plugin, None)
+        if key is not None:
+            self._z_order.pop(bisect.bisect_left(self._z_order, key))
+            key = (z_index, key[1])
+        else:
+            key = (z_index, next(self._insertion_counter))
+        self._z_keys[plugin] = key
+        bisect.insort(self._z_order, key + (plugin,)) # Insertion counters are unique, so plugins themselves are never compared
+        self._plugin_z_index[plugin] = z_index
+        self._occluded = None
+
+    def _set_plugin_box(self, plugin: PluginBase, box: tuple[int, int, int, int]):
+        previous = self._composited.get(plugin)
+        if previous is not None and previous[2] != box:
+            # Damage where it was shown now: if it ends up occluded, it won't be composited (and compared) again
+            self._pending_damage.append(previous[2])
+            self._composited[plugin] = (previous[0], None, box) # Still the last good frame, but never matches the next one
+        self._plugin_coordinates[plugin] = box
+        self._spatial.insert(plugin, box)
+        self._occluded = None
+
     def _get_z_ordered_plugin_list(self, *, pairs:bool = False, reverse:bool = False):
         '''
         Returns member plugins ordered by their z-index. Pairs will return (z-index, plugin) tuples.
         '''
-        sorted_plugins = [(z_ind, plugin) for plugin, z_ind in self._plugin_z_index.items()]
-        sorted_plugins.sort(key = lambda x: x[0], reverse = reverse)
+        z_order = reversed(self._z_order) if reverse else self._z_order
         if pairs:
-            return sorted_plugins
+            return [(z_ind, plugin) for z_ind, _, plugin in z_order]
         else:
-            return [plugin for _, plugin in sorted_plugins]
+            return [plugin for _, _, plugin in z_order]
 
-    async def draw(self) -> Image:
+    def plugins_in_rect(self, box: tuple[int, int, int, int]) -> list[PluginBase]:
         '''
-        Draws a frame using all of the plugin canvases.
+        Returns the plugins intersecting box, in draw order
+        '''
+        return sorted(self._spatial.query(box), key = self._z_keys.__getitem__)
 
-        Returns the Layout's canvas
+    def occluded_plugins(self) -> set[PluginBase]:
+        '''
+        Returns the plugins that can't be seen because an opaque plugin above them covers their whole box.
+        These are not drawn at all.
+        '''
+        if self._occluded is None:
+            occluded = set()
+            for plugin, box in self._plugin_coordinates.items():
+                key = self._z_keys[plugin]
+                for other in self._spatial.covering(box):
+                    if other.opaque and self._z_keys[other] > key:
+                        occluded.add(plugin)
+                        break
+            self._occluded = occluded
+        return self._occluded
+
+    def damage(self, box: tuple[int, int, int, int] = None):
+        '''
+        Marks an area of the screen as needing to be recomposited on the next draw.
+        Damages the whole screen if no box is given.
         '''
-        self._canvas.paste( (0, 0, 0), (0, 0, self._canvas.width, self._canvas.height)) # Fill entire screen with black
+        if box is None:
+            self._full_redraw = True
+        else:
+            self._pending_damage.append(box)
+
+    def _collect_damage(self, canvases: dict) -> list:
+        '''
+        Compares the freshly drawn plugin canvases with what was composited last frame
+        and returns the list of boxes that need to be recomposited.
+        '''
+        damage = self._pending_damage
+        self._pending_damage = []
+        for plugin, canvas in canvases.items():
+            coords = self._plugin_coordinates[plugin]
+            current = (canvas, plugin.version, coords)
+            previous = self._composited.get(plugin)
+            self._composited[plugin] = current
+            if previous is not None and previous[0] is canvas and previous[1:] == current[1:]:
+                continue
+            if canvas is not None:
+                damage.append(coords)
+            if previous is not None and previous[0] is not None:
+                damage.append(previous[2])
+
+        screen = (0, 0, self._canvas.width, self._canvas.height)
+        if self._full_redraw or self.debug_borders:
+            self._full_redraw = False
+            return [screen]
+        return merge_boxes(damage, screen)
+
+    def _composite_region(self, box, plugin, canvas):
+        '''
+        Pastes the part of a plugin's canvas that falls within box onto the layout canvas
+        '''
+        coords = self._plugin_coordinates[plugin]
+        if canvas.size != (coords[2] - coords[0], coords[3] - coords[1]):
+            raise ValueError(f"expected a {coords[2] - coords[0]}x{coords[3] - coords[1]} frame, got {canvas.width}x{canvas.height}")
+
+        region = box_intersection(coords, box)
+        if region is None:
+            return
+        src_box = (region[0] - coords[0], region[1] - coords[1], region[2] - coords[0], region[3] - coords[1])
+        self._compositor.blit(canvas, region, src_box, key = (plugin, plugin.version))
 
+    async def gather_plugin_frames(self) -> dict:
+        '''
+        Asks every plugin for a frame. Returns a dict of plugin -> canvas (or None) in draw order.
+
+        All draws share one deadline (draw_budget). A plugin that misses it keeps its last good frame
+        on screen for this frame instead of disappearing, and its draw keeps running in the background;
+        when it finishes, another frame is requested and its result is used then.
+        '''
         tasks = {} # Make a copy dict in case plugins gets mutated asyncronously, i guess
         sorted_plugins = self._get_z_ordered_plugin_list() # Get plugins in order by their z-index. Code below asumes this is the draw order
+        occluded = self.occluded_plugins()
+        if occluded:
+            self.stats.increment("layout.occluded_skips", len(occluded))
 
+        canvases = {}
+        cache_hits = 0
         for plugin in sorted_plugins:
-            tasks[plugin] = asyncio.wait_for(plugin.draw(), timeout=0.1) # 100 ms to draw
+            if plugin in occluded:
+                continue
+            task = self._draw_tasks.get(plugin) # Still running (or finished late) from an earlier frame
+            if task is None:
+                cached = self._cached_output(plugin)
+                if cached is not None:
+                    canvases[plugin] = cached
+                    cache_hits += 1
+                    continue
+                task = self._draw_tasks[plugin] = asyncio.create_task(self._timed_draw(plugin))
+            canvases[plugin] = None # Placeholder keeping the draw order
+            tasks[plugin] = task
+
+        if cache_hits:
+            self.stats.increment("layout.draw_cache_hits", cache_hits)
+        if not tasks:
+            return canvases
+        self.stats.increment("layout.draw_cache_misses", len(tasks))
+
+        running = [task for task in tasks.values() if not task.done()]
+        if running:
+            budget = self.draw_budget if self.draw_budget is not None else self._display_manager.frame_interval / 2
+            await asyncio.wait(running, timeout = budget)
+
+        for plugin, task in tasks.items():
+            self.stats.increment(f"plugin.frames.{plugin.name}")
+            if not task.done():
+                self.stats.increment(f"plugin.deadline_misses.{plugin.name}")
+                previous = self._composited.get(plugin)
+                canvases[plugin] = previous[0] if previous is not None else None # Last good frame
+                if plugin not in self._late_draws:
+                    self._late_draws.add(plugin)
+                    task.add_done_callback(lambda task, plugin = plugin: self._late_draw_finished(plugin))
+                continue
 
-        canvases = await asyncio.gather(*tasks.values(), return_exceptions = True)
-        for canvas, plugin in zip(canvases, tasks.keys()):
-            if not canvas:
+            if self._draw_tasks.get(plugin) is task: # A concurrent draw (e.g. an unscheduled request_immediate_draw) may have collected it already
+                del self._draw_tasks[plugin]
+                self._late_draws.discard(plugin)
+            if task.cancelled():
                 continue
-            if isinstance(canvas, Exception):
-                print(f"Warning: {plugin} draw() call returned an exception and could not be composited:", canvas)
+            if task.exception() is not None:
+                self.stats.increment(f"plugin.errors.{plugin.name}")
+                print(f"Warning: {plugin} draw() call returned an exception and could not be composited:", task.exception())
                 continue # Skip compositiing a plugin if it's draw function has errored
+            canvas = task.result()
+            canvases[plugin] = canvas if canvas else None
+        return canvases
 
-            try:
-                coords = self._plugin_coordinates[plugin]
-                if self.debug_borders:
-                    border_w = 1 # pixel
-                    border_im = Image.new("RGB", (canvas.width + border_w * 2, canvas.height + border_w * 2), tuple(random.sample(range(0, 255), 3)))
-                    border_im.paste(canvas, (border_w, border_w))
-                    canvas = border_im
-                    coords = (coords[0]-border_w, coords[1]-border_w, coords[2]+border_w, coords[3]+border_w)
-                self._canvas.paste(canvas, coords, (canvas if canvas.mode == "RGBA" else None))
-            except Exception as e:
-                print(f"{plugin} failed to paste onto layout. This is probably because the plugin illegally changed the size of its frame: {e}")
+    def _late_draw_finished(self, plugin: PluginBase):
+        '''
+        Called when a draw that missed its frame's deadline completes. Its result is picked up by the next frame.
+        '''
+        if self._visible and plugin in self._draw_tasks:
+            asyncio.create_task(self._display_manager.request_immediate_draw())
+
+    def miss_rate(self, plugin: PluginBase) -> float:
+        '''
+        Fraction of the frames this plugin was drawn for in which it missed the draw deadline
+        '''
+        frames = self.stats.counters.get(f"plugin.frames.{plugin.name}", 0)
+        return self.stats.counters.get(f"plugin.deadline_misses.{plugin.name}", 0) / frames if frames else 0.0
 
+    def _cached_output(self, plugin: PluginBase) -> Image:
+        '''
+        Returns the canvas last composited for a plugin with cache_output set if it is still valid, otherwise None
+        '''
+        if not plugin.cache_output:
+            return None
+        previous = self._composited.get(plugin)
+        if previous is None or previous[1] != plugin.version or previous[2] != self._plugin_coordinates[plugin]:
+            return None
+        return previous[0]
+
+    async def _timed_draw(self, plugin: PluginBase):
+        start = time.perf_counter()
+        try:
+            return await plugin.draw()
+        finally:
+            self.stats.record(f"plugin.draw_ms.{plugin.name}", (time.perf_counter() - start) * 1000)
+
+    def composite(self, canvases: dict) -> Image:
+        '''
+        Composites plugin canvases (as returned by gather_plugin_frames) onto the layout canvas.
+        Only the regions whose plugins changed since the last frame are recomposited.
+
+        This does not touch the event loop, so it is safe to run in an executor.
+        '''
+        start = time.perf_counter()
+        damage = self._collect_damage(canvases)
+        self.last_damage_rects = damage
+        self.last_damaged_area = sum(box_area(box) for box in damage)
+
+        for box in damage:
+            self._compositor.fill(box) # Clear the damaged area to black
+            for plugin in (canvases if self.debug_borders else self.plugins_in_rect(box)):
+                canvas = canvases.get(plugin)
+                if canvas is None:
+                    continue
+                coords = self._plugin_coordinates[plugin]
+                try:
+                    if self.debug_borders:
+                        border_w = 1 # pixel
+                        self._compositor.fill((coords[0]-border_w, coords[1]-border_w, coords[2]+border_w, coords[3]+border_w), tuple(random.sample(range(0, 255), 3)))
+                        self._compositor.blit(canvas, coords, (0, 0, canvas.width, canvas.height), key = (plugin, plugin.version), opaque = True)
+                    else:
+                        self._composite_region(box, plugin, canvas)
+                except Exception as e:
+                    self.stats.increment(f"plugin.paste_failures.{plugin.name}")
+                    print(f"{plugin} failed to paste onto layout. This is probably because the plugin illegally changed the size of its frame: {e}")
+
+        if damage:
+            self._compositor.finish()
+        self.stats.record("layout.composite_ms", (time.perf_counter() - start) * 1000)
+        self.stats.record("layout.damaged_area", self.last_damaged_area)
         return self._canvas
 
+    async def draw(self, *, executor = None) -> Image:
+        '''
+        Draws a frame using all of the plugin canvases.
+
+        Plugin draw() calls always run on the event loop. If an executor is given,
+        compositing is done in it so that the event loop stays free for plugin I/O.
+
+        Returns the Layout's canvas
+        '''
+        canvases = await self.gather_plugin_frames()
+        if executor is None:
+            return self.composite(canvases)
+        return await asyncio.get_running_loop().run_in_executor(executor, self.composite, canvases)
+
     async def screen_updated(self):
         '''
         Called right after the screen updates.
@@ -157,9 +434,10 @@ class Layout():
         new_height = (height if height is not None else old_height)
 
         if z_index is not None:
-            self._plugin_z_index[plugin] = z_index
+            self._set_z_index(plugin, z_index)
+            self.damage(old_coords)
 
-        self._plugin_coordinates[plugin] = tuple(new_coords)
+        self._set_plugin_box(plugin, tuple(new_coords))
         await plugin.resize_requested(new_width, new_height)
         if redraw:
             await self._display_manager.request_immediate_draw()
@@ -167,17 +445,47 @@ class Layout():
     async def handle_plugin_changeover(self):
         '''
         Called when this layout becomes active (before activated is called)
-        Notifies plugins that this layout is visible and asks them to resize accordingly.
+        Notifies plugins that this layout is visible and asks the ones that were last shown at a different size to resize.
 
         This function is separated for the convenience of subclasses.
         '''
-        tasks = []
-        for plugin, dimensions in self._plugin_coordinates.items():
-            width = abs(dimensions[2] - dimensions[0])
-            height = abs(dimensions[3] - dimensions[1])
-            tasks.append(plugin.resize_requested(width, height))
+        if not self._prewarmed:
+            self.damage() # Plugins may have changed while we were hidden. A prewarmed canvas is already up to date.
+        self._prewarmed = False
+        await self._resize_plugins(self._plugins)
+
+    async def _resize_plugins(self, plugins):
+        tasks = [plugin.resize_requested(*self._plugin_size(plugin)) for plugin in plugins if plugin._canvas_size != self._plugin_size(plugin)]
         await asyncio.gather(*tasks, return_exceptions = True)
 
+    def _plugin_size(self, plugin: PluginBase) -> tuple[int, int]:
+        dimensions = self._plugin_coordinates[plugin]
+        return (abs(dimensions[2] - dimensions[0]), abs(dimensions[3] - dimensions[1]))
+
+    async def prewarm(self):
+        '''
+        Does the work of switching to this layout ahead of time while another layout is visible:
+        resizes plugins, runs their prewarm() hooks and composites a first frame. Switching to
+        a prewarmed layout then only costs a single (mostly cached) frame.
+
+        Plugins that are on screen in the current layout are left alone, they are resized during the switch as usual.
+        If any of them is shown at a different size here, no first frame is drawn.
+        '''
+        current = self._display_manager.current_layout
+        if current is self:
+            return
+        visible = set(current.plugins) if current is not None else set()
+        hidden_plugins = [plugin for plugin in self._plugins if plugin not in visible]
+
+        start = time.perf_counter()
+        await self._resize_plugins(hidden_plugins)
+        await asyncio.gather(*(plugin.prewarm() for plugin in hidden_plugins), return_exceptions = True)
+        if all(plugin._canvas_size == self._plugin_size(plugin) for plugin in visible.intersection(self._plugins)):
+            self.damage()
+            self.composite(await self.gather_plugin_frames())
+            self._prewarmed = True
+        self.stats.record("layout.prewarm_ms", (time.perf_counter() - start) * 1000)
+
     # This is kind of janky and arguably it would be better to 
     async def plugin_draw_requested(self, plugin: PluginBase) -> Image:
         '''
@@ -190,6 +498,7 @@ class Layout():
         canvas = await plugin.draw()
         self._canvas.paste( (0, 0, 0), self._plugin_coordinates[plugin])
         self._canvas.paste(canvas, self._plugin_coordinates[plugin])
+        self.damage(self._plugin_coordinates[plugin]) # Restore proper z-ordering on the next full draw
         return self._canvas
 
     async def activated(self, previous_layout):
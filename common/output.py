@@ -0,0 +1,153 @@
+from PIL import Image
+from collections import deque
+
+import os
+import sys
+import time
+
+class OutputBackend():
+
+    '''
+    A base class for the things frames are pushed to once a layout has been composited.
+
+    show() receives the layout's canvas (an RGB Image). Backends must not hold on to it past
+    the call as the layout keeps drawing into the same instance.
+
+    Backends that set accepts_buffer are handed the compositor's (height, width, 3) uint8
+    NumPy frame buffer through show_buffer() instead, when the layout has one.
+    '''
+
+    accepts_buffer = False
+
+    def show(self, image: Image):
+        '''
+        Pushes a frame out
+        '''
+        raise NotImplementedError
+
+    def show_buffer(self, buffer):
+        '''
+        Pushes a frame out from a raw RGB frame buffer. Only called if accepts_buffer is set.
+        '''
+        raise NotImplementedError
+
+    def close(self):
+        '''
+        Called when the backend is no longer going to be used
+        '''
+        pass
+
+class MatrixOutput(OutputBackend):
+
+    '''
+    Pushes frames straight to the panel with matrix.SetImage. This is simple,
+    but the panel is updated while it is being refreshed which can cause tearing.
+    '''
+
+    def __init__(self, matrix):
+        self.matrix = matrix
+
+    def show(self, image: Image):
+        self.matrix.SetImage(image)
+
+class DoubleBufferedOutput(OutputBackend):
+
+    '''
+    Fills an offscreen canvas and swaps it in on the next vertical sync.
+
+    The matrix owns two buffers: the one being displayed and our offscreen one.
+    SwapOnVSync hands back the buffer that was just on screen, which becomes the
+    next offscreen canvas, so the same two buffers are reused forever.
+    '''
+
+    def __init__(self, matrix, *, framerate_fraction = 1):
+        self.matrix = matrix
+        self.framerate_fraction = framerate_fraction # Swap on every n-th refresh of the panel
+        self._offscreen = matrix.CreateFrameCanvas()
+
+    def show(self, image: Image):
+        self._offscreen.SetImage(image)
+        self._offscreen = self.matrix.SwapOnVSync(self._offscreen, self.framerate_fraction)
+
+class NullOutput(OutputBackend):
+
+    '''
+    Throws every frame away. Useful for measuring how fast frames can be produced.
+    '''
+
+    accepts_buffer = True
+
+    def __init__(self):
+        self.frames = 0
+
+    def show(self, image: Image):
+        self.frames += 1
+
+    def show_buffer(self, buffer):
+        self.frames += 1
+
+class RawFrameWriter(OutputBackend):
+
+    '''
+    Writes every frame as raw 8-bit RGB to a file or pipe ("-" for stdout).
+
+    When writing to stdout, stdout is taken over for frames: anything else written to it from then on,
+    by print() or by subprocesses, goes to stderr instead so it can't corrupt the video stream.
+
+    The output can be watched with something like:
+    ffplay -f rawvideo -pixel_format rgb24 -video_size 64x64 -
+    '''
+
+    def __init__(self, target = "-"):
+        self._owns_file = False
+        if target == "-":
+            sys.stdout.flush()
+            self._file = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+            self._owns_file = True
+            os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+        elif isinstance(target, str):
+            self._file = open(target, "wb")
+            self._owns_file = True
+        else:
+            self._file = target # Already a binary file-like object
+        self.frames = 0
+
+    accepts_buffer = True
+
+    def show(self, image: Image):
+        self._file.write(image.tobytes())
+        self._file.flush()
+        self.frames += 1
+
+    def show_buffer(self, buffer):
+        self._file.write(buffer.data) # Written straight from the compositor's array, no copy
+        self._file.flush()
+        self.frames += 1
+
+    def close(self):
+        if self._owns_file:
+            self._file.close()
+
+class RecorderOutput(OutputBackend):
+
+    '''
+    Keeps copies of the most recent frames in memory along with the time they were shown.
+    max_frames bounds how many are kept (None keeps everything).
+    '''
+
+    def __init__(self, max_frames: int = 600):
+        self.frames: deque[tuple[float, Image]] = deque(maxlen = max_frames)
+        self.frame_count = 0
+
+    def show(self, image: Image):
+        self.frames.append((time.perf_counter(), image.copy()))
+        self.frame_count += 1
+
+    @property
+    def last_frame(self) -> Image:
+        if not self.frames:
+            return None
+        return self.frames[-1][1]
+
+    def clear(self):
+        self.frames.clear()
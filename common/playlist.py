@@ -0,0 +1,151 @@
+from datetime import datetime
+import asyncio
+
+class CronRule():
+
+    '''
+    A crontab-style schedule: "minute hour day-of-month month day-of-week".
+    Fields accept *, numbers, ranges (a-b), lists (a,b) and steps (*/n, a-b/n). Day of week 0 is Sunday.
+    '''
+
+    FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 6))
+
+    def __init__(self, expression: str):
+        self.expression = expression
+        fields = expression.split()
+        if len(fields) != len(self.FIELDS):
+            raise ValueError(f"Expected 5 fields in cron expression {expression!r}")
+        self._allowed = [self._parse(field, low, high) for field, (low, high) in zip(fields, self.FIELDS)]
+
+    @staticmethod
+    def _parse(field: str, low: int, high: int) -> frozenset[int]:
+        allowed = set()
+        for part in field.split(","):
+            part, _, step = part.partition("/")
+            if part == "*":
+                start, end = low, high
+            elif "-" in part:
+                start, end = (int(value) for value in part.split("-", 1))
+            else:
+                start = end = int(part)
+            if start < low or end > high or start > end:
+                raise ValueError(f"{part!r} is out of range {low}-{high}")
+            allowed.update(range(start, end + 1, int(step) if step else 1))
+        return frozenset(allowed)
+
+    def matches(self, dt: datetime) -> bool:
+        minutes, hours, days, months, weekdays = self._allowed
+        return (dt.minute in minutes and dt.hour in hours and dt.day in days
+                and dt.month in months and dt.isoweekday() % 7 in weekdays)
+
+    def __repr__(self):
+        return f"CronRule({self.expression!r})"
+
+class PlaylistEntry():
+
+    def __init__(self, layout, *, duration: float, schedule: CronRule = None, transition: str = None, transition_duration: float = 0.5):
+        self.layout = layout
+        self.duration = duration
+        self.schedule = schedule
+        self.transition = transition
+        self.transition_duration = transition_duration
+
+class Playlist():
+
+    '''
+    Rotates a display manager through its layouts.
+
+    Each entry is shown for its duration. Entries with a schedule (a CronRule or a crontab expression)
+    are only shown while it matches, and take priority over unscheduled entries when they do.
+
+    prewarm_lead seconds before every switch, the next layout is prewarmed (see Layout.prewarm),
+    so the switch itself only costs a single frame.
+    '''
+
+    def __init__(self, display_manager, *, prewarm_lead: float = 2):
+        self.display_manager = display_manager
+        self.prewarm_lead = prewarm_lead
+        self.entries: list[PlaylistEntry] = []
+        self._index = -1
+        self._task = None
+
+    def add(self, layout, *, duration: float = 10, schedule: str | CronRule = None, transition: str = None, transition_duration: float = 0.5) -> PlaylistEntry:
+        if isinstance(schedule, str):
+            schedule = CronRule(schedule)
+        entry = PlaylistEntry(layout, duration = duration, schedule = schedule, transition = transition, transition_duration = transition_duration)
+        self.entries.append(entry)
+        return entry
+
+    def remove(self, layout):
+        '''
+        Removes every entry showing layout
+        '''
+        self.entries = [entry for entry in self.entries if entry.layout is not layout]
+
+    def next_index(self, now: datetime = None) -> int:
+        '''
+        Returns the index of the entry to show after the current one at time now, or None if nothing can be shown
+        '''
+        now = now or datetime.now()
+        count = len(self.entries)
+        order = [(self._index + offset) % count for offset in range(1, count + 1)] # Round robin, starting after the current entry
+        eligible = [index for index in order
+                    if self.entries[index].layout in self.display_manager.layouts # Skip unregistered layouts
+                    and (self.entries[index].schedule is None or self.entries[index].schedule.matches(now))]
+        scheduled = [index for index in eligible if self.entries[index].schedule is not None]
+        if scheduled:
+            return scheduled[0]
+        return eligible[0] if eligible else None
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        '''
+        Starts rotating layouts. Must be called from within a running event loop.
+        '''
+        if self.running:
+            return self._task
+        self._task = asyncio.create_task(self._run())
+        return self._task
+
+    async def stop(self):
+        if not self.running:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        display_manager = self.display_manager
+        index = self.next_index()
+        while True:
+            if index is None:
+                await asyncio.sleep(1) # Nothing scheduled right now
+                index = self.next_index()
+                continue
+
+            entry = self.entries[index]
+            self._index = index
+            deadline = loop.time() + entry.duration
+            if entry.layout is not display_manager.current_layout:
+                try:
+                    await display_manager.switch_layout(entry.layout, transition = entry.transition, duration = entry.transition_duration)
+                except Exception as e:
+                    print(f"Warning: could not switch to {entry.layout}:", e) # Keep rotating, the next entry may work
+
+            await asyncio.sleep(max(0, deadline - self.prewarm_lead - loop.time()))
+            switch_time = datetime.now().timestamp() + max(0, deadline - loop.time())
+            upcoming = self.next_index(datetime.fromtimestamp(switch_time))
+            if upcoming is not None and self.entries[upcoming].layout is not display_manager.current_layout:
+                try:
+                    await self.entries[upcoming].layout.prewarm()
+                except Exception as e:
+                    print(f"Warning: could not prewarm {self.entries[upcoming].layout}:", e)
+            await asyncio.sleep(max(0, deadline - loop.time()))
+            index = self.next_index() # Entries may have changed while we waited
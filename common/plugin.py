@@ -1,6 +1,11 @@
 
 from PIL import Image
 
+import asyncio
+import itertools
+
+_plugin_ids = itertools.count(1)
+
 class PluginBase():
    
     '''
@@ -10,7 +15,29 @@ class PluginBase():
     This base class is configured to do the former.
 
     Remember: plugins must not resize their own windows!
+
+    Layouts only recomposite the parts of the screen that changed. A plugin
+    returning a different Image instance from draw() is noticed automatically,
+    but plugins that continuously update a single instance must call invalidate()
+    whenever they change it.
+
+    Plugins that set cache_output promise that draw() returns the same content until
+    they call invalidate(). Layouts then reuse the last canvas instead of calling draw()
+    every frame, so a static plugin costs nothing until it changes.
+
+    Periodic work (updating a clock, fetching something) should be registered with every()
+    rather than run in a task of its own: it is then paused while the plugin isn't visible.
     '''
+
+    _version = 0 # Bumped by invalidate()
+    cache_output = False # Set to True to have layouts only call draw() after invalidate() (or a resize)
+    opaque = False # Set to True if draw() always fills the whole box without transparency. Lets layouts skip plugins hidden beneath it.
+    _name = None
+    _surface: Image.Image = None
+    _back_surface: Image.Image = None # The other half of the surface double buffer, see clear_surface()
+    surface_mode = "RGBA" # Mode of the image returned by surface
+    _ticks: list = None
+    _ticks_active = False
  
     def __init__(self, dimensions: tuple[int, int], display_manager):
         # self._canvas: Image = canvas # Shared between Layout and Plugin (passed by reference)
@@ -19,6 +46,109 @@ class PluginBase():
         self._height = dimensions[1]
         self.display_manager = display_manager # Reference to the parent window manager
 
+    @property
+    def name(self):
+        '''
+        A label for this plugin instance, used in stats. Defaults to the module name and an instance number.
+        '''
+        if self._name is None:
+            self._name = f"{self.__class__.__module__}:{next(_plugin_ids)}"
+        return self._name
+
+    @name.setter
+    def name(self, value):
+        self._name = value
+
+    @property
+    def version(self):
+        '''
+        A counter that changes every time the plugin declares its output as changed
+        '''
+        return self._version
+
+    def invalidate(self):
+        '''
+        Marks the output of this plugin as changed so that layouts recomposite it on their next draw.
+        '''
+        self._version += 1
+
+    @property
+    def surface(self) -> Image.Image:
+        '''
+        A persistent image the size of this plugin, owned by the plugin, for draw() to draw into and return.
+        It is only reallocated when the plugin is resized, so drawing into it doesn't allocate a new Image every frame.
+
+        Layouts can't tell that a reused image changed, so draw into it through clear_surface() (or call invalidate()).
+        Only touch it from draw(): in threaded render mode it may be read by the render thread between draws.
+        '''
+        if self._surface is None or self._surface.size != self._canvas_size:
+            self._surface = Image.new(self.surface_mode, self._canvas_size)
+        return self._surface
+
+    def clear_surface(self, color = 0) -> Image.Image:
+        '''
+        Clears surface (to transparent by default), marks the plugin as changed and returns surface.
+
+        surface is double buffered: this swaps to the image that wasn't returned last, so a draw that
+        clears it and then awaits never touches the frame a layout keeps showing when that draw misses its deadline.
+        '''
+        self._surface, self._back_surface = self._back_surface, self._surface
+        surface = self.surface
+        surface.paste(color, (0, 0) + surface.size)
+        self.invalidate()
+        return surface
+
+    def every(self, interval: float, callback, *, align: bool = True):
+        '''
+        Calls callback (a function or coroutine function taking no arguments) every interval seconds while this plugin is visible.
+
+        Ticks are driven by the display manager's shared common.ticker.Ticker. Aligned ticks fire on wall clock
+        multiples of interval (every() with 1 fires on the second). The layout pauses them when the plugin is deactivated,
+        resumes them when it is activated and cancels them when it is torn down. If callback invalidates the plugin,
+        a draw is requested, once for every tick due at the same time. Returns the common.ticker.Tick, whose interval can be changed.
+        '''
+        def run():
+            version = self._version
+            result = callback()
+            if asyncio.iscoroutine(result):
+                return self._finish_tick(result, version)
+            return self._version != version
+
+        tick = self.display_manager.ticker.every(interval, run, align = align, paused = not self._ticks_active)
+        if self._ticks is None:
+            self._ticks = []
+        self._ticks.append(tick)
+        return tick
+
+    async def _finish_tick(self, result, version) -> bool:
+        await result
+        return self._version != version
+
+    def resume_ticks(self):
+        '''
+        Resumes the callbacks registered with every(). Called by the display manager when the plugin is activated.
+        '''
+        self._ticks_active = True
+        for tick in self._ticks or ():
+            tick.resume()
+
+    def pause_ticks(self):
+        '''
+        Pauses the callbacks registered with every(). Called by the display manager when the plugin is deactivated.
+        '''
+        self._ticks_active = False
+        for tick in self._ticks or ():
+            tick.pause()
+
+    def cancel_ticks(self):
+        '''
+        Cancels the callbacks registered with every() for good. Called before the plugin is torn down.
+        '''
+        self._ticks_active = False
+        for tick in self._ticks or ():
+            tick.cancel()
+        self._ticks = None
+
     async def draw(self) -> Image:
         '''
         Draws the canvas of this plugin.
@@ -56,10 +186,20 @@ class PluginBase():
         Subclasses may also use super().resize_requested for convenience
         '''
         #self._canvas = self._canvas.resize((width, height))
+        if (width, height) != self._canvas_size:
+            self.invalidate()
+            self._surface = self._back_surface = None # Reallocated at the new size on next use
         self._canvas_size = (width, height)
         self._width = width
         self._height = height
 
+    async def prewarm(self):
+        '''
+        Called shortly before a layout containing this plugin becomes visible, after the plugin has been resized for it.
+
+        Plugins can do slow preparation here (e.g. decoding an image) so that it is done before the switch.
+        '''
+
     async def deactivated(self):
         '''
         Called when this plugin is no longer visible.
@@ -0,0 +1,306 @@
+from common.plugin import PluginBase, _plugin_ids
+from common.stats import Stats
+from common.ticker import Ticker
+
+from multiprocessing import shared_memory
+from importlib import import_module
+from PIL import Image
+import asyncio
+import json
+import os
+import struct
+import subprocess
+import sys
+import time
+
+# Shared memory layout: a header followed by two RGBA frames the size of the plugin's box.
+# The worker draws into the back frame and then flips front to it, bumping seq before (odd)
+# and after (even) the write like a seqlock. The layout copies the front frame and checks seq
+# again to make sure the worker didn't start overwriting it in the meantime.
+HEADER = struct.Struct("<QI4x") # seq, front frame index
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _frame_bytes(size) -> int:
+    return size[0] * size[1] * 4
+
+def _create_frame_memory(size) -> shared_memory.SharedMemory:
+    memory = shared_memory.SharedMemory(create = True, size = HEADER.size + 2 * _frame_bytes(size))
+    HEADER.pack_into(memory.buf, 0, 0, 0)
+    return memory
+
+class SandboxedPlugin(PluginBase):
+
+    '''
+    Runs a plugin module in a worker process so that its draw() can't stall the event loop,
+    and can use another core.
+
+    The worker draws whenever the plugin asks for a draw (at most max_fps times a second) and
+    publishes the frame into shared memory. Here, draw() only copies the latest completed frame
+    into this plugin's surface, so it always returns quickly no matter what the plugin is doing.
+
+    options are passed to the module's setup() in the worker and must be JSON serializable.
+    Layout callbacks other than resizes and (de)activation are not forwarded.
+    '''
+
+    cache_output = True # Invalidated whenever the worker publishes a frame
+
+    def __init__(self, module: str, dimensions, display_manager, *, max_fps: float = 30, **options):
+        super().__init__(dimensions, display_manager)
+        self.module = module
+        self.options = options
+        self.max_fps = max_fps
+        self.name = f"{module}:{next(_plugin_ids)}"
+        self._memory = _create_frame_memory(dimensions)
+        self._old_memory = None # (memory, size) before a resize, kept until the worker publishes at the new size
+        self._retired_memory = [] # Segments of resizes superseded before the worker published into them
+        self._output_buffer = b""
+        self._reader_loop = None
+        self.alive = True
+
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, (PACKAGE_ROOT, env.get("PYTHONPATH"))))
+        self._process = subprocess.Popen(
+            [sys.executable, "-m", "common.sandbox", module, json.dumps(options), self._memory.name, str(dimensions[0]), str(dimensions[1]), str(max_fps)],
+            stdin = subprocess.PIPE, stdout = subprocess.PIPE, env = env)
+        self._register_reader()
+
+    def _register_reader(self):
+        '''
+        Starts listening for frame notifications from the worker. Needs a running event loop, so may have to wait for the first callback.
+        '''
+        if self._reader_loop is not None or not self.alive:
+            return
+        try:
+            self._reader_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._reader_loop.add_reader(self._process.stdout.fileno(), self._on_worker_output)
+
+    def _on_worker_output(self):
+        data = os.read(self._process.stdout.fileno(), 4096)
+        if not data:
+            self._worker_exited()
+            return
+
+        lines = (self._output_buffer + data).split(b"\n")
+        self._output_buffer = lines.pop()
+        published = False
+        for line in lines:
+            fields = line.split()
+            if fields and fields[0] == b"frame":
+                published = True
+                self.display_manager.stats.record(f"sandbox.draw_ms.{self.name}", float(fields[1]))
+        if published:
+            self.invalidate()
+            asyncio.create_task(self.display_manager.request_immediate_draw())
+
+    def _worker_exited(self):
+        self._reader_loop.remove_reader(self._process.stdout.fileno())
+        if self.alive:
+            self.alive = False
+            self.display_manager.stats.increment(f"sandbox.exits.{self.name}")
+            print(f"Warning: sandboxed plugin {self.name} exited with code {self._process.poll()}, showing its last frame")
+
+    def _send(self, command: str, **fields):
+        try:
+            self._process.stdin.write(json.dumps({"command": command, **fields}).encode() + b"\n")
+            self._process.stdin.flush()
+        except (BrokenPipeError, ValueError):
+            pass # The worker is gone, _worker_exited reports it
+
+    def _read_frame(self) -> Image.Image:
+        '''
+        Copies the latest completed frame into surface. Returns None if the worker hasn't published one yet.
+
+        Right after a resize, until the worker publishes at the new size, the last frame at the old size is shown scaled instead.
+        '''
+        if self._old_memory is not None:
+            if HEADER.unpack_from(self._memory.buf, 0)[0] == 0:
+                old_memory, old_size = self._old_memory
+                frame = self._copy_frame(old_memory, old_size, Image.new("RGBA", old_size))
+                return frame.resize(self._canvas_size) if frame is not None else None
+            self._release_old_memory()
+        return self._copy_frame(self._memory, self._canvas_size, self.surface)
+
+    def _copy_frame(self, memory: shared_memory.SharedMemory, size, surface: Image.Image) -> Image.Image:
+        buf = memory.buf
+        frame_bytes = _frame_bytes(size)
+        for attempt in range(3):
+            seq, front = HEADER.unpack_from(buf, 0)
+            if seq == 0:
+                return None
+            offset = HEADER.size + front * frame_bytes
+            surface.frombytes(buf[offset:offset + frame_bytes])
+            # Safe unless the worker has since flipped frames and started writing into the one we just read
+            if HEADER.unpack_from(buf, 0)[0] - seq <= (2 if seq % 2 == 0 else 1):
+                return surface
+        self.display_manager.stats.increment(f"sandbox.torn_frames.{self.name}")
+        return surface
+
+    async def draw(self) -> Image:
+        self._register_reader()
+        return self._read_frame()
+
+    def _release_old_memory(self):
+        '''
+        Frees the segments kept around across resizes. The worker has switched over once it publishes at the new size.
+        '''
+        if self._old_memory is not None:
+            self._retired_memory.append(self._old_memory[0])
+            self._old_memory = None
+        for memory in self._retired_memory:
+            memory.close()
+            memory.unlink()
+        self._retired_memory.clear()
+
+    async def resize_requested(self, width, height):
+        if (width, height) != self._canvas_size:
+            if self._old_memory is None or HEADER.unpack_from(self._memory.buf, 0)[0] != 0:
+                self._release_old_memory()
+                self._old_memory = (self._memory, self._canvas_size) # Its last frame is shown until the worker publishes at the new size
+            else:
+                # Resized again before the worker published at the previous new size: keep showing the older frame.
+                # The worker may not have attached to the superseded segment yet, so it can't be unlinked until it switched over.
+                self._retired_memory.append(self._memory)
+            self._memory = _create_frame_memory((width, height))
+            self._send("resize", size = [width, height], memory = self._memory.name)
+        await super().resize_requested(width, height)
+
+    async def activated(self):
+        self._register_reader()
+        self._send("activated")
+
+    async def deactivated(self):
+        self._send("deactivated")
+
+    async def teardown(self):
+        self._send("stop")
+        if self._reader_loop is not None and self.alive:
+            self._reader_loop.remove_reader(self._process.stdout.fileno())
+        self.alive = False
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._process.wait, 2)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+        self._release_old_memory()
+        self._memory.close()
+        self._memory.unlink()
+
+class _WorkerDisplayManager():
+
+    '''
+    Stands in for the DisplayManager inside a worker process. Draw requests make the worker publish a new frame.
+    '''
+
+    def __init__(self):
+        self.stats = Stats() # Not reported back, the layout records the worker's draw times itself
+        self.ticker = Ticker(self)
+        self.dirty = asyncio.Event()
+
+    def mark_dirty(self):
+        self.dirty.set()
+
+    async def request_immediate_draw(self):
+        self.dirty.set()
+        return True
+
+    async def request_plugin_immediate_draw(self, plugin):
+        self.dirty.set()
+        return True
+
+class _Worker():
+
+    def __init__(self, module: str, options: dict, size: tuple[int, int], memory_name: str, max_fps: float):
+        self.display_manager = _WorkerDisplayManager()
+        self.size = size
+        self.memory = self._attach(memory_name)
+        self.max_fps = max_fps
+        self.protocol = os.fdopen(os.dup(sys.stdout.fileno()), "w")
+        sys.stdout = sys.stderr # Plugin output must not end up in the frame notifications
+        self.plugin = import_module(module).setup(size, self.display_manager, **options)
+        self.stopped = asyncio.Event()
+        self._input_buffer = b""
+
+    @staticmethod
+    def _attach(name: str) -> shared_memory.SharedMemory:
+        memory = shared_memory.SharedMemory(name = name)
+        try:
+            # The layout owns the memory. Stop this process's resource tracker from unlinking it on exit.
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(memory._name, "shared_memory")
+        except Exception:
+            pass
+        return memory
+
+    def publish(self, image: Image.Image):
+        buf = self.memory.buf
+        frame_bytes = _frame_bytes(self.size)
+        seq, front = HEADER.unpack_from(buf, 0)
+        back = 1 - front
+        HEADER.pack_into(buf, 0, seq + 1, front)
+        buf[HEADER.size + back * frame_bytes:HEADER.size + (back + 1) * frame_bytes] = image.tobytes()
+        HEADER.pack_into(buf, 0, seq + 2, back)
+
+    async def handle(self, message: dict):
+        command = message["command"]
+        if command == "resize":
+            self.memory.close()
+            self.memory = self._attach(message["memory"])
+            self.size = tuple(message["size"])
+            await self.plugin.resize_requested(*self.size)
+            self.display_manager.dirty.set()
+        elif command == "activated":
+            self.plugin.resume_ticks()
+            await self.plugin.activated()
+        elif command == "deactivated":
+            self.plugin.pause_ticks()
+            await self.plugin.deactivated()
+        elif command == "stop":
+            self.stopped.set()
+
+    def _on_input(self):
+        data = os.read(sys.stdin.fileno(), 4096)
+        if not data:
+            self.stopped.set() # The layout's process is gone
+            return
+        lines = (self._input_buffer + data).split(b"\n")
+        self._input_buffer = lines.pop()
+        for line in lines:
+            asyncio.create_task(self.handle(json.loads(line)))
+
+    async def draw_loop(self):
+        dirty = self.display_manager.dirty
+        dirty.set() # Publish a first frame right away
+        while True:
+            await dirty.wait()
+            dirty.clear()
+            start = time.perf_counter()
+            try:
+                image = await self.plugin.draw()
+            except Exception as e:
+                print(f"Warning: {self.plugin} draw() raised an exception:", e, file = sys.stderr)
+                image = None
+            if image is not None:
+                if image.mode != "RGBA":
+                    image = image.convert("RGBA")
+                if image.size == self.size:
+                    self.publish(image)
+                    self.protocol.write(f"frame {(time.perf_counter() - start) * 1000:.3f}\n")
+                    self.protocol.flush()
+            await asyncio.sleep(max(0, start + 1 / self.max_fps - time.perf_counter()))
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        loop.add_reader(sys.stdin.fileno(), self._on_input)
+        draw_task = asyncio.create_task(self.draw_loop())
+        await self.stopped.wait()
+        draw_task.cancel()
+        self.plugin.cancel_ticks()
+        await self.plugin.teardown()
+        self.memory.close()
+
+async def _serve(module, options, memory_name, width, height, max_fps):
+    await _Worker(module, json.loads(options), (int(width), int(height)), memory_name, float(max_fps)).run()
+
+if __name__ == "__main__":
+    asyncio.run(_serve(*sys.argv[1:]))
@@ -0,0 +1,60 @@
+from common.util import box_intersection, box_contains
+
+class SpatialIndex():
+
+    '''
+    A uniform grid over (x1, y1, x2, y2) boxes answering "what intersects this box" without
+    looking at every item. Items are bucketed into every cell their box touches.
+    '''
+
+    def __init__(self, cell_size: int = 16):
+        self.cell_size = cell_size
+        self._cells: dict[tuple[int, int], set] = {}
+        self._boxes: dict[object, tuple[int, int, int, int]] = {}
+
+    def __contains__(self, item):
+        return item in self._boxes
+
+    def __len__(self):
+        return len(self._boxes)
+
+    def _cells_for(self, box):
+        size = self.cell_size
+        for cell_x in range(box[0] // size, (box[2] - 1) // size + 1):
+            for cell_y in range(box[1] // size, (box[3] - 1) // size + 1):
+                yield (cell_x, cell_y)
+
+    def insert(self, item, box: tuple[int, int, int, int]):
+        if item in self._boxes:
+            self.remove(item)
+        self._boxes[item] = box
+        for cell in self._cells_for(box):
+            self._cells.setdefault(cell, set()).add(item)
+
+    def remove(self, item):
+        box = self._boxes.pop(item)
+        for cell in self._cells_for(box):
+            bucket = self._cells[cell]
+            bucket.discard(item)
+            if not bucket:
+                del self._cells[cell]
+
+    def box(self, item) -> tuple[int, int, int, int]:
+        return self._boxes[item]
+
+    def query(self, box: tuple[int, int, int, int]) -> set:
+        '''
+        Returns every item whose box shares at least one pixel with box
+        '''
+        found = set()
+        for cell in self._cells_for(box):
+            bucket = self._cells.get(cell)
+            if bucket:
+                found.update(bucket)
+        return {item for item in found if box_intersection(self._boxes[item], box) is not None}
+
+    def covering(self, box: tuple[int, int, int, int]) -> set:
+        '''
+        Returns every item whose box fully contains box
+        '''
+        return {item for item in self.query(box) if box_contains(self._boxes[item], box)}
@@ -0,0 +1,137 @@
+from collections import deque, defaultdict
+from contextlib import contextmanager
+
+import asyncio
+import json
+import time
+
+class RollingHistogram():
+
+    '''
+    Keeps the most recent samples of a measurement and summarizes them on demand.
+    Recording is just a deque append so it is cheap enough for the hot path.
+    '''
+
+    def __init__(self, size: int = 600):
+        self._samples = deque(maxlen = size)
+        self.count = 0 # Total number of samples ever recorded, not just the ones in the window
+
+    def record(self, value: float):
+        self._samples.append(value)
+        self.count += 1
+
+    def percentile(self, fraction: float) -> float:
+        if not self._samples:
+            return 0
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def summary(self) -> dict:
+        if not self._samples:
+            return {"count": self.count}
+        ordered = sorted(self._samples)
+        last = len(ordered) - 1
+        return {
+            "count": self.count,
+            "mean": sum(ordered) / len(ordered),
+            "p50": ordered[int(0.50 * last)],
+            "p90": ordered[int(0.90 * last)],
+            "p99": ordered[int(0.99 * last)],
+            "max": ordered[-1],
+        }
+
+class Stats():
+
+    '''
+    A registry of rolling histograms and counters.
+
+    Timings are recorded in milliseconds under names ending in "_ms".
+    Names are dotted, e.g. "plugin.draw_ms.modules.clock:1".
+    '''
+
+    def __init__(self, window: int = 600):
+        self.window = window
+        self.histograms: dict[str, RollingHistogram] = {}
+        self.counters: dict[str, int] = defaultdict(int)
+
+    def record(self, name: str, value: float):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = RollingHistogram(self.window)
+        histogram.record(value)
+
+    def increment(self, name: str, amount: int = 1):
+        self.counters[name] += amount
+
+    @contextmanager
+    def timer(self, name: str):
+        '''
+        Records how long the body of a with block takes, in milliseconds
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - start) * 1000)
+
+    def snapshot(self) -> dict:
+        return {
+            # Copies first as the render thread may add new entries while we iterate
+            "histograms": {name: histogram.summary() for name, histogram in list(self.histograms.items())},
+            "counters": dict(list(self.counters.items())),
+        }
+
+    def reset(self):
+        self.histograms.clear()
+        self.counters.clear()
+
+class StatsServer():
+
+    '''
+    Serves Stats snapshots as JSON, either over HTTP on a local TCP port
+    or as a plain dump to anyone connecting to a Unix socket.
+    '''
+
+    def __init__(self, stats: Stats, *, host: str = "127.0.0.1", port: int = None, path: str = None):
+        if (port is None) == (path is None):
+            raise ValueError("Exactly one of port or path must be given")
+        self.stats = stats
+        self.host = host
+        self.port = port
+        self.path = path
+        self._server = None
+
+    async def start(self):
+        if self.path is not None:
+            self._server = await asyncio.start_unix_server(self._handle_unix, self.path)
+        else:
+            self._server = await asyncio.start_server(self._handle_http, self.host, self.port)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def _body(self) -> bytes:
+        return json.dumps(self.stats.snapshot(), indent = 1).encode()
+
+    async def _handle_unix(self, reader, writer):
+        writer.write(self._body())
+        await writer.drain()
+        writer.close()
+
+    async def _handle_http(self, reader, writer):
+        try:
+            # We serve the same thing on every path, so just skip past the request headers
+            while (await asyncio.wait_for(reader.readline(), timeout = 5)) not in (b"\r\n", b"\n", b""):
+                pass
+            body = self._body()
+            writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: application/json\r\n")
+            writer.write(f"Content-Length: {len(body)}\r\n\r\n".encode())
+            writer.write(body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
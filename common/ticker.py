@@ -0,0 +1,187 @@
+import asyncio
+import heapq
+import itertools
+import math
+import time
+
+class Tick():
+
+    '''
+    A periodic callback registered with a Ticker. Returned by Ticker.every().
+    '''
+
+    def __init__(self, ticker, interval: float, callback, *, align: bool, paused: bool):
+        self.ticker = ticker
+        self.callback = callback
+        self.align = align
+        self._interval = interval
+        self._due = None # Event loop time of the next call, None while paused
+        self._generation = 0 # Bumped whenever the tick is rescheduled, so stale heap entries can be told apart
+        self._running = None # Task of an async callback that hasn't finished yet
+        self.cancelled = False
+        self.paused = paused
+
+    @property
+    def interval(self) -> float:
+        return self._interval
+
+    @interval.setter
+    def interval(self, value: float):
+        if value <= 0:
+            raise ValueError("Tick interval must be positive")
+        if value != self._interval:
+            self._interval = value
+            if self._due is not None:
+                self.ticker._schedule(self, restart = True)
+
+    def pause(self):
+        if not self.paused:
+            self.paused = True
+            self._due = None
+            self._generation += 1
+
+    def resume(self):
+        if self.paused and not self.cancelled:
+            self.paused = False
+            self.ticker._schedule(self, restart = True)
+
+    def cancel(self):
+        self.pause()
+        self.cancelled = True
+        if self._running is not None:
+            self._running.cancel()
+
+class Ticker():
+
+    '''
+    One timer shared by every periodic callback of a display manager, instead of a task sleeping in a loop for each one.
+
+    Aligned ticks fire on multiples of their interval in wall clock time (a 1 s tick fires on the second,
+    a 0.25 s tick on every quarter second) and never drift, however late they run: missed ticks are skipped.
+    Ticks are scheduled on the event loop's monotonic clock; the wall clock is only read to find the phase
+    of the next aligned tick, so a wall clock step (e.g. NTP setting the time on a Pi without an RTC) shifts
+    aligned ticks onto the new second rather than stalling them.
+    The timer fires batch_window after the earliest tick falls due, and every tick due by then runs in that one
+    wakeup, so ticks are never early and at most batch_window late. If any of them returned a truthy value, a single
+    draw is requested for all of them once they have finished (async callbacks still running after batch_window
+    request their own draw when done).
+
+    Records ticker.wakeups and ticker.callbacks counters and ticker.lateness_ms in the display manager's stats.
+    '''
+
+    def __init__(self, display_manager, *, batch_window: float = 0.005):
+        self.display_manager = display_manager
+        self.batch_window = batch_window
+        self._heap: list[tuple[float, int, int, Tick]] = [] # (due, order, generation, tick)
+        self._order = itertools.count()
+        self._timer: asyncio.TimerHandle = None
+        self._timer_due = None
+
+    def every(self, interval: float, callback, *, align: bool = True, paused: bool = False) -> Tick:
+        '''
+        Calls callback (a function or coroutine function taking no arguments) every interval seconds.
+        Without align, the first call is interval seconds from now (or from resuming).
+        Must be called from within a running event loop unless paused.
+        '''
+        if interval <= 0:
+            raise ValueError("Tick interval must be positive")
+        tick = Tick(self, interval, callback, align = align, paused = paused)
+        if not paused:
+            self._schedule(tick, restart = True)
+        return tick
+
+    def _next_due(self, tick: Tick, now: float, restart: bool) -> float:
+        interval = tick.interval
+        if tick.align:
+            wall = time.time()
+            due = now + (math.floor(wall / interval) + 1) * interval - wall
+            if not restart and tick._due is not None and due <= tick._due + interval / 2:
+                due += interval # Rounding put us just before the tick that just ran
+            return due
+        if restart or tick._due is None:
+            return now + interval
+        # Keep the original phase, skipping any ticks that were missed
+        return tick._due + max(1, math.ceil((now - tick._due) / interval)) * interval
+
+    def _schedule(self, tick: Tick, *, restart: bool = False):
+        tick._due = self._next_due(tick, asyncio.get_running_loop().time(), restart)
+        tick._generation += 1
+        heapq.heappush(self._heap, (tick._due, next(self._order), tick._generation, tick))
+        self._arm()
+
+    def _arm(self):
+        '''
+        Makes sure the timer fires for the earliest live tick
+        '''
+        heap = self._heap
+        while heap and heap[0][2] != heap[0][3]._generation:
+            heapq.heappop(heap) # Paused, cancelled or rescheduled since
+        if not heap:
+            return
+        fire_at = heap[0][0] + self.batch_window
+        if self._timer is not None:
+            if self._timer_due <= fire_at:
+                return
+            self._timer.cancel()
+        loop = asyncio.get_running_loop()
+        self._timer_due = fire_at
+        self._timer = loop.call_at(fire_at, self._wake)
+
+    def _wake(self):
+        self._timer = None
+        now = asyncio.get_running_loop().time()
+        stats = self.display_manager.stats
+        stats.increment("ticker.wakeups")
+
+        batch = []
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            due, _, generation, tick = heapq.heappop(heap)
+            if generation != tick._generation:
+                continue
+            batch.append(tick)
+            stats.record("ticker.lateness_ms", (now - due) * 1000)
+        if batch:
+            asyncio.create_task(self._run(batch))
+        for tick in batch:
+            self._schedule(tick)
+        self._arm()
+
+    async def _run(self, batch: list[Tick]):
+        stats = self.display_manager.stats
+        redraw = False
+        pending = []
+        for tick in batch:
+            if tick._running is not None:
+                stats.increment("ticker.overruns") # The previous call is still going, skip this one
+                continue
+            stats.increment("ticker.callbacks")
+            try:
+                result = tick.callback()
+            except Exception as e:
+                print(f"Warning: tick callback {tick.callback} raised an exception:", e)
+                continue
+            if asyncio.iscoroutine(result):
+                tick._running = asyncio.create_task(result)
+                tick._running.add_done_callback(lambda task, tick = tick: self._finished(tick, task))
+                pending.append(tick._running)
+            elif result:
+                redraw = True
+
+        if pending:
+            done, stragglers = await asyncio.wait(pending, timeout = self.batch_window)
+            for task in done:
+                redraw = redraw or (not task.cancelled() and task.exception() is None and bool(task.result()))
+            for task in stragglers:
+                task.add_done_callback(self._late_result)
+        if redraw:
+            await self.display_manager.request_immediate_draw()
+
+    def _finished(self, tick: Tick, task: asyncio.Task):
+        tick._running = None
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Warning: tick callback {tick.callback} raised an exception:", task.exception())
+
+    def _late_result(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is None and task.result():
+            asyncio.create_task(self.display_manager.request_immediate_draw())
@@ -0,0 +1,61 @@
+from PIL import Image
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Transitions between two full-screen frames. Every frame of a transition is computed in one
+# batched NumPy pass from the last frame of the old layout and the first frame of the new one,
+# so streaming it to the panel afterwards costs nothing but the output update.
+#
+# Each function takes the before and after frames as (height, width, 3) uint8 arrays and the
+# progress of every frame as a float array in (0, 1), and returns a (frames, height, width, 3) uint8 array.
+
+def crossfade(before, after, progress):
+    t = progress.astype(np.float32)[:, None, None, None]
+    frames = after.astype(np.float32) * t
+    frames += before.astype(np.float32) * (1 - t)
+    frames += 0.5 # Round rather than truncate
+    return frames.astype(np.uint8)
+
+def slide(before, after, progress):
+    '''
+    The new layout pushes the old one out to the left
+    '''
+    width = before.shape[1]
+    strip = np.concatenate((before, after), axis = 1) # (height, 2 * width, 3)
+    offsets = np.rint(progress * width).astype(np.intp)
+    columns = np.arange(width)[None, :] + offsets[:, None] # (frames, width) column of strip shown at each x
+    return strip[:, columns].transpose(1, 0, 2, 3) # (height, frames, width, 3) -> (frames, height, width, 3)
+
+def wipe(before, after, progress):
+    '''
+    The new layout is uncovered from left to right
+    '''
+    width = before.shape[1]
+    edges = np.rint(progress * width).astype(np.intp)
+    mask = np.arange(width)[None, :] < edges[:, None] # (frames, width)
+    return np.where(mask[:, None, :, None], after, before)
+
+TRANSITIONS = {
+    "crossfade": crossfade,
+    "slide": slide,
+    "wipe": wipe,
+}
+
+def render_transition(name: str, before: Image.Image, after: Image.Image, frame_count: int, images: bool = True):
+    '''
+    Computes every frame of a transition between two RGB images.
+    Returns a list of (buffer, image) pairs, one per frame. Images are only created if images is set
+    (outputs that take raw buffers don't need them). Blocking, run it in an executor.
+    '''
+    if np is None:
+        raise ImportError("Layout transitions require numpy to be installed")
+    if name not in TRANSITIONS:
+        raise ValueError(f"Unknown transition {name!r}, expected one of {tuple(TRANSITIONS)}")
+
+    progress = np.arange(1, frame_count + 1, dtype = np.float32) / (frame_count + 1) # The final frame is the new layout itself, drawn afterwards
+    frames = TRANSITIONS[name](np.asarray(before.convert("RGB")), np.asarray(after.convert("RGB")), progress)
+    frames = np.ascontiguousarray(frames)
+    return [(frame, Image.fromarray(frame) if images else None) for frame in frames]
@@ -34,4 +34,52 @@ def box_overlap(box1: (int, int, int, int), box2: (int, int, int, int)):
     if box1[3] < box2[1] or box1[1] > box2[3]:
         return False
     
-    return True
\ No newline at end of file
+    return True
+
+def box_intersection(box1: (int, int, int, int), box2: (int, int, int, int)):
+    '''
+    Returns the (x1, y1, x2, y2) box shared by both boxes, or None if they don't share any pixels.
+    '''
+    x1 = max(box1[0], box2[0])
+    y1 = max(box1[1], box2[1])
+    x2 = min(box1[2], box2[2])
+    y2 = min(box1[3], box2[3])
+    if x1 >= x2 or y1 >= y2:
+        return None
+    return (x1, y1, x2, y2)
+
+def box_contains(outer: (int, int, int, int), inner: (int, int, int, int)):
+    '''
+    Checks if inner lies entirely within outer
+    '''
+    return outer[0] <= inner[0] and outer[1] <= inner[1] and outer[2] >= inner[2] and outer[3] >= inner[3]
+
+def box_union(box1: (int, int, int, int), box2: (int, int, int, int)):
+    '''
+    Returns the smallest box containing both boxes.
+    '''
+    return (min(box1[0], box2[0]), min(box1[1], box2[1]), max(box1[2], box2[2]), max(box1[3], box2[3]))
+
+def box_area(box: (int, int, int, int)):
+    return max(0, box[2] - box[0]) * max(0, box[3] - box[1])
+
+def merge_boxes(boxes: list, bounds: (int, int, int, int) = None):
+    '''
+    Merges overlapping (or touching) boxes into their unions so that no pixel is covered twice.
+    If bounds is given, boxes are clipped to it first and boxes outside of it are dropped.
+    '''
+    merged = []
+    for box in boxes:
+        if bounds is not None:
+            box = box_intersection(box, bounds)
+            if box is None:
+                continue
+        i = 0
+        while i < len(merged):
+            if box_overlap(merged[i], box):
+                box = box_union(merged.pop(i), box)
+                i = 0 # The grown box may now overlap boxes we already checked
+            else:
+                i += 1
+        merged.append(box)
+    return merged
@@ -0,0 +1,429 @@
+from common.output import OutputBackend, NullOutput
+from common.stats import Stats
+
+from PIL import Image
+from urllib.parse import urlsplit
+import asyncio
+import errno
+import hashlib
+import select
+import socket
+import struct
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Frames for remote tiles are sent as one message per tile: a header followed by the payload.
+# Payloads are the tile's raw RGB24 pixels, a run-length encoding of them, or a run-length
+# encoding of the XOR with the previous frame (a delta: pixels that didn't change XOR to long runs of zeros).
+# Each side keeps the previous frame to apply deltas to. Deltas are only applied on top of the frame
+# with the sequence number just before theirs; after a lost UDP datagram the receiver waits for the
+# next keyframe, which is sent periodically.
+HEADER = struct.Struct("<4sBBHHHIId") # magic, version, encoding, tile, width, height, seq, payload length, send time
+MAGIC = b"LEDW"
+VERSION = 1
+RAW, RLE, DELTA_RLE = 0, 1, 2
+MAX_DATAGRAM = 65507
+
+def rle_encode(data) -> bytes:
+    '''
+    Run-length encodes a uint8 array as a run count, then every run's length (uint32), then every run's byte value
+    '''
+    flat = data.reshape(-1)
+    if flat.size == 0:
+        return struct.pack("<I", 0)
+    starts = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    starts = np.concatenate(([0], starts))
+    lengths = np.diff(starts, append = flat.size).astype("<u4")
+    return struct.pack("<I", len(starts)) + lengths.tobytes() + flat[starts].tobytes()
+
+def rle_decode(payload):
+    (count,) = struct.unpack_from("<I", payload)
+    lengths = np.frombuffer(payload, "<u4", count, 4)
+    values = np.frombuffer(payload, np.uint8, count, 4 + 4 * count)
+    return np.repeat(values, lengths)
+
+def encode_tile(tile: int, frame, previous, seq: int, *, sent_at: float = None) -> bytes:
+    '''
+    Encodes a (height, width, 3) uint8 frame as a message, choosing the smallest encoding.
+    previous is the frame the receiver has (for a delta) or None to send a keyframe.
+    '''
+    raw = frame.reshape(-1)
+    candidates = [(RAW, raw.data), (RLE, rle_encode(raw))]
+    if previous is not None:
+        candidates.append((DELTA_RLE, rle_encode(np.bitwise_xor(raw, previous.reshape(-1)))))
+    encoding, payload = min(candidates, key = lambda candidate: len(candidate[1]))
+    height, width = frame.shape[:2]
+    header = HEADER.pack(MAGIC, VERSION, encoding, tile, width, height, seq, len(payload), time.time() if sent_at is None else sent_at)
+    return header + bytes(payload)
+
+class TileDecoder():
+
+    '''
+    Turns messages back into frames, keeping the previous frame of every tile to apply deltas to
+    '''
+
+    def __init__(self):
+        self._frames: dict[int, tuple] = {} # tile -> (seq, frame)
+        self.dropped = 0 # Deltas that couldn't be applied because a message went missing
+
+    def decode(self, message) -> tuple:
+        '''
+        Returns (tile, frame, sent_at), or None if the message can't be decoded yet
+        '''
+        magic, version, encoding, tile, width, height, seq, length, sent_at = HEADER.unpack_from(message)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a panel wall message")
+        payload = memoryview(message)[HEADER.size:HEADER.size + length]
+        shape = (height, width, 3)
+
+        if encoding == RAW:
+            frame = np.frombuffer(payload, np.uint8).reshape(shape).copy()
+        elif encoding == RLE:
+            frame = rle_decode(payload).reshape(shape)
+        elif encoding == DELTA_RLE:
+            previous = self._frames.get(tile)
+            if previous is None or previous[0] != seq - 1 or previous[1].shape != shape:
+                self.dropped += 1
+                self._frames.pop(tile, None) # Wait for a keyframe
+                return None
+            frame = np.bitwise_xor(previous[1], rle_decode(payload).reshape(shape))
+        else:
+            raise ValueError(f"Unknown encoding {encoding}")
+        self._frames[tile] = (seq, frame)
+        return tile, frame, sent_at
+
+class RemoteTile(OutputBackend):
+
+    '''
+    Sends a tile's frames to a TileReceiver on another machine over UDP or TCP.
+
+    Deltas are sent whenever possible. A keyframe is sent first, after reconnecting (TCP),
+    and every keyframe_interval seconds (UDP, to recover from lost datagrams). Over TCP, a tile that
+    hasn't changed is still resent every keyframe_interval seconds (as a tiny delta), so a receiver that went
+    away is noticed and the tile reconnects and sends a keyframe once it is back.
+    TCP connection failures are retried at most every retry_interval seconds; frames are dropped meanwhile.
+
+    Sockets never block, since frames are usually pushed from the event loop: connecting happens in the
+    background, and a frame that finds the socket still busy with the previous one is dropped (the rest of
+    a partially sent message goes out first, so the stream stays intact).
+    '''
+
+    accepts_buffer = True
+
+    def __init__(self, host: str, port: int, *, protocol: str = "udp", tile: int = 0, keyframe_interval: float = 2, retry_interval: float = 2):
+        if protocol not in ("udp", "tcp"):
+            raise ValueError(f"Unknown protocol {protocol!r}, expected udp or tcp")
+        self.address = (host, port)
+        self.protocol = protocol
+        self.tile = tile
+        self.keyframe_interval = keyframe_interval
+        self.retry_interval = retry_interval
+        self._socket: socket.socket = None
+        self._connecting = False # TCP connect still in progress
+        self._unsent = b"" # Rest of a TCP message the socket couldn't take at once
+        self._last_connect_attempt = None
+        self._previous = None
+        self._seq = 0
+        self._last_keyframe = None
+        self._last_send = None
+        self.bytes_sent = 0
+        self.send_errors = 0
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs):
+        '''
+        Creates a remote tile from "udp://host:port" or "tcp://host:port"
+        '''
+        parts = urlsplit(url)
+        return cls(parts.hostname, parts.port, protocol = parts.scheme, **kwargs)
+
+    @property
+    def refresh_due(self) -> bool:
+        '''
+        Whether the tile should be sent even though it didn't change: it hasn't reached the receiver yet
+        (e.g. after a failed send or reconnecting) or keyframe_interval has passed
+        '''
+        if self._previous is None:
+            return True
+        if self.keyframe_interval is None:
+            return False
+        last = self._last_keyframe if self.protocol == "udp" else self._last_send
+        return time.monotonic() - last >= self.keyframe_interval
+
+    def _failed(self):
+        self.send_errors += 1
+        self.close()
+
+    def _connect(self) -> socket.socket:
+        '''
+        Returns the socket if it is ready to send on, otherwise starts or checks on connecting and returns None
+        '''
+        if self._socket is None and self.protocol == "udp":
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._socket.setblocking(False)
+        if self._socket is None:
+            now = time.monotonic()
+            if self._last_connect_attempt is not None and now - self._last_connect_attempt < self.retry_interval:
+                return None
+            self._last_connect_attempt = now
+            try:
+                host = socket.gethostbyname(self.address[0]) # Only blocks for names that aren't cached or in /etc/hosts
+                self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            except OSError:
+                self.send_errors += 1
+                return None
+            self._socket.setblocking(False)
+            self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            result = self._socket.connect_ex((host, self.address[1]))
+            if result not in (0, errno.EINPROGRESS):
+                self._failed()
+                return None
+            self._connecting = True
+            self._previous = None # New connection, new receiver state
+        if self._connecting:
+            if not select.select([], [self._socket], [], 0)[1]:
+                if time.monotonic() - self._last_connect_attempt >= self.retry_interval:
+                    self._failed() # Give up on this attempt, the next frame starts another
+                return None
+            if self._socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) != 0:
+                self._failed()
+                return None
+            self._connecting = False
+        return self._socket
+
+    def show(self, image: Image):
+        self.show_buffer(np.asarray(image.convert("RGB")))
+
+    def show_buffer(self, buffer) -> int:
+        '''
+        Sends a frame. Returns the number of bytes sent.
+        '''
+        sock = self._connect()
+        if sock is None:
+            return 0
+        try:
+            if self._unsent:
+                self._unsent = self._unsent[sock.send(self._unsent):]
+                if self._unsent:
+                    return 0 # Still busy with the previous frame, drop this one
+        except BlockingIOError:
+            return 0
+        except OSError:
+            self._failed()
+            return 0
+        keyframe = self._previous is None or self._previous.shape != buffer.shape or (self.protocol == "udp" and self.refresh_due)
+        self._seq = (self._seq + 1) & 0xFFFFFFFF
+        message = encode_tile(self.tile, buffer, None if keyframe else self._previous, self._seq)
+        try:
+            if self.protocol == "udp":
+                if len(message) > MAX_DATAGRAM:
+                    raise ValueError(f"A {buffer.shape[1]}x{buffer.shape[0]} tile doesn't fit in a UDP datagram, use tcp")
+                sock.sendto(message, self.address)
+            else:
+                self._unsent = message[sock.send(message):]
+        except BlockingIOError:
+            self._seq = (self._seq - 1) & 0xFFFFFFFF # Nothing went out, drop the frame
+            return 0
+        except OSError:
+            self._failed()
+            return 0
+        self._last_send = time.monotonic()
+        if keyframe:
+            self._last_keyframe = self._last_send
+        if self._previous is None or self._previous.shape != buffer.shape:
+            self._previous = np.empty_like(buffer)
+        np.copyto(self._previous, buffer)
+        self.bytes_sent += len(message)
+        return len(message)
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+        self._connecting = False
+        self._unsent = b""
+        self._previous = None
+
+class TiledOutput(OutputBackend):
+
+    '''
+    Splits the canvas into tiles, each pushed to its own output: a local panel chain or a RemoteTile.
+
+    Every tile's pixels are hashed each frame and tiles that didn't change aren't pushed at all,
+    unless a remote tile asks for a refresh or its last send failed.
+    Records wall.bytes_per_frame (bytes sent to remote tiles), wall.tiles_sent, wall.tiles_skipped
+    and wall.split_ms in stats.
+    '''
+
+    accepts_buffer = True
+
+    def __init__(self, tiles: list[tuple[tuple[int, int, int, int], OutputBackend]] = (), *, stats: Stats = None):
+        if np is None:
+            raise ImportError("Panel walls require numpy to be installed")
+        self.stats = stats if stats is not None else Stats()
+        self._tiles = []
+        for box, backend in tiles:
+            self.add_tile(box, backend)
+
+    @property
+    def size(self) -> tuple[int, int]:
+        '''
+        Size of the virtual canvas covering every tile
+        '''
+        return (max((tile[0][2] for tile in self._tiles), default = 0), max((tile[0][3] for tile in self._tiles), default = 0))
+
+    def add_tile(self, box: tuple[int, int, int, int], backend: OutputBackend):
+        width, height = box[2] - box[0], box[3] - box[1]
+        scratch = np.empty((height, width, 3), dtype = np.uint8) # Contiguous copy of the tile, for hashing and sending
+        image = None if backend.accepts_buffer else Image.new("RGB", (width, height)) # Reused for backends that need an Image
+        self._tiles.append([box, backend, scratch, image, None])
+
+    def show(self, image: Image):
+        self.show_buffer(np.asarray(image))
+
+    def show_buffer(self, buffer):
+        start = time.perf_counter()
+        sent_bytes = 0
+        for tile in self._tiles:
+            box, backend, scratch, image, digest = tile
+            np.copyto(scratch, buffer[box[1]:box[3], box[0]:box[2]])
+            new_digest = hashlib.blake2b(scratch.data, digest_size = 16).digest()
+            if new_digest == digest and not getattr(backend, "refresh_due", False):
+                self.stats.increment("wall.tiles_skipped")
+                continue
+
+            if image is not None:
+                image.frombytes(scratch.data)
+                backend.show(image)
+            else:
+                sent = backend.show_buffer(scratch)
+                if isinstance(backend, RemoteTile):
+                    if not sent:
+                        continue # Not connected or failed, keep trying until the tile gets through
+                    sent_bytes += sent
+            tile[4] = new_digest
+            self.stats.increment("wall.tiles_sent")
+        self.stats.record("wall.bytes_per_frame", sent_bytes)
+        self.stats.record("wall.split_ms", (time.perf_counter() - start) * 1000)
+
+    def close(self):
+        for tile in self._tiles:
+            tile[1].close()
+
+class TileReceiver():
+
+    '''
+    The receiving end of RemoteTile: decodes tile messages and shows them on a local output.
+    Run one on each receiver Pi (python -m common.wall), or in the same process to test a wall on one machine.
+
+    Records wall.latency_ms (from the sender's send time to the frame being shown, so the clocks
+    of both machines must be in sync for remote receivers), wall.bytes_received and wall.dropped_deltas in stats.
+    '''
+
+    def __init__(self, output: OutputBackend, *, host: str = "0.0.0.0", port: int = 0, protocol: str = "udp", stats: Stats = None):
+        if np is None:
+            raise ImportError("Panel walls require numpy to be installed")
+        self.output = output
+        self.host = host
+        self.port = port
+        self.protocol = protocol
+        self.stats = stats if stats is not None else Stats()
+        self.decoder = TileDecoder()
+        self._server = None
+        self._transport = None
+        self._connections = set()
+        self.frames = 0
+
+    async def start(self):
+        '''
+        Starts listening. If port was 0, port is set to the one picked by the OS.
+        '''
+        loop = asyncio.get_running_loop()
+        if self.protocol == "udp":
+            receiver = self
+            class Protocol(asyncio.DatagramProtocol):
+                def datagram_received(self, data, addr):
+                    receiver.handle(data)
+            self._transport, _ = await loop.create_datagram_endpoint(Protocol, local_addr = (self.host, self.port))
+            self.port = self._transport.get_extra_info("sockname")[1]
+        else:
+            self._server = await asyncio.start_server(self._serve_connection, self.host, self.port)
+            self.port = self._server.sockets[0].getsockname()[1]
+
+    async def _serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                header = await reader.readexactly(HEADER.size)
+                length = HEADER.unpack(header)[7]
+                self.handle(header + await reader.readexactly(length))
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass # Closed by either side. Cancellation is swallowed as asyncio < 3.12 logs it as an error for server handlers
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    def handle(self, message: bytes):
+        try:
+            decoded = self.decoder.decode(message)
+        except (ValueError, struct.error) as e:
+            print("Warning: ignoring a bad tile message:", e)
+            return
+        self.stats.increment("wall.bytes_received", len(message))
+        if decoded is None:
+            self.stats.increment("wall.dropped_deltas")
+            return
+        tile, frame, sent_at = decoded
+        if self.output.accepts_buffer:
+            self.output.show_buffer(frame)
+        else:
+            self.output.show(Image.fromarray(frame))
+        self.frames += 1
+        self.stats.record("wall.latency_ms", (time.time() - sent_at) * 1000)
+
+    async def close(self):
+        if self._transport is not None:
+            self._transport.close()
+        if self._server is not None:
+            self._server.close()
+            for task in list(self._connections):
+                task.cancel()
+            await asyncio.gather(*self._connections, return_exceptions = True)
+            await self._server.wait_closed()
+
+async def _receive(args):
+    output = NullOutput()
+    try:
+        from rgbmatrix import RGBMatrix, RGBMatrixOptions
+        from common.output import MatrixOutput
+        options = RGBMatrixOptions()
+        options.rows = args.rows
+        options.cols = args.cols
+        options.chain_length = args.chain_length
+        options.hardware_mapping = 'adafruit-hat-pwm'
+        output = MatrixOutput(RGBMatrix(options = options))
+    except ImportError:
+        print("Warning: rgbmatrix could not be imported, frames will be discarded")
+
+    receiver = TileReceiver(output, port = args.port, protocol = args.protocol)
+    await receiver.start()
+    print(f"Receiving tiles over {args.protocol} on port {receiver.port}")
+    while True:
+        await asyncio.sleep(10)
+        latency = receiver.stats.histograms.get("wall.latency_ms")
+        print(f"{receiver.frames} frames, {receiver.stats.counters['wall.bytes_received']} bytes received, latency {latency.summary() if latency else '-'}")
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description = "Receives panel wall tiles sent by another LED Box and shows them on the local panel")
+    parser.add_argument("--port", type = int, default = 7000)
+    parser.add_argument("--protocol", choices = ("udp", "tcp"), default = "udp")
+    parser.add_argument("--rows", type = int, default = 32)
+    parser.add_argument("--cols", type = int, default = 64)
+    parser.add_argument("--chain-length", type = int, default = 1)
+    asyncio.run(_receive(parser.parse_args()))
@@ -0,0 +1,181 @@
+from common.plugin import PluginBase
+from common.imaging import decode_executor, fit_image
+
+from PIL import Image
+import asyncio
+
+MIN_FRAME_DURATION = 0.02 # seconds. Like browsers do, shorter frame durations are treated as 100 ms
+
+class AnimationPlugin(PluginBase):
+
+    '''
+    Plays animated GIF, APNG and WebP files, respecting each frame's duration.
+
+    Frames are decoded and scaled to the plugin's box once, off the event loop, whenever
+    the plugin is resized. Files that would not fit in memory_budget bytes once decoded are
+    decoded lazily instead, one frame ahead of playback.
+
+    Playback follows the file's timeline rather than sleeping a fixed amount per frame:
+    if the plugin wakes up late, frames whose time has already passed are skipped.
+    Skipped frames and frames replaced before they ever reached the panel are counted in frames_dropped.
+    '''
+
+    cache_output = True # Every frame change calls invalidate()
+
+    def __init__(self, dim, display_manager, *, path: str = None, loop: bool = True, memory_budget: int = 16 * 1024 * 1024):
+        super().__init__(dim, display_manager)
+        self.path = path
+        self.loop = loop
+        self.memory_budget = memory_budget
+
+        self._durations: list[float] = []
+        self._frames: list[Image.Image] = None # None if frames are decoded lazily
+        self._source: Image.Image = None # Kept open for lazy decoding
+        self._loaded_size = None
+        self._loaded = asyncio.Event()
+        self._load_lock = asyncio.Lock()
+        self._prefetch = None # (index, future) of the next lazily decoded frame
+
+        self._current: Image.Image = None
+        self._current_shown = True # Whether the current frame made it to the panel
+        self._play_task = None
+        self.frames_shown = 0
+        self.frames_dropped = 0
+
+    @property
+    def frame_count(self):
+        return len(self._durations)
+
+    async def load(self, path: str = None):
+        '''
+        Decodes path (or the current file) for the current plugin size
+        '''
+        if path is not None:
+            self.path = path
+            self._loaded_size = None
+        if self.path is None:
+            return
+
+        async with self._load_lock:
+            size = self._canvas_size
+            if self._loaded_size == size:
+                return
+            durations, frames, source = await asyncio.get_running_loop().run_in_executor(decode_executor, self._decode_all, self.path, size)
+            self._close_source()
+            self._durations, self._frames, self._source = durations, frames, source
+            self._loaded_size = size
+            self._prefetch = None
+            self._current = await self._get_frame(0)
+            self.invalidate()
+            self._loaded.set()
+
+    def _decode_all(self, path, size):
+        '''
+        Reads every frame's duration and, if the animation fits in the memory budget, decodes and scales all frames
+        '''
+        source = Image.open(path)
+        frame_count = getattr(source, "n_frames", 1)
+        predecode = frame_count * size[0] * size[1] * 4 <= self.memory_budget
+
+        durations = []
+        frames = [] if predecode else None
+        for index in range(frame_count):
+            source.seek(index)
+            duration = source.info.get("duration", 100) / 1000
+            durations.append(duration if duration >= MIN_FRAME_DURATION else 0.1)
+            if predecode:
+                frames.append(fit_image(source, size))
+
+        if predecode:
+            source.close()
+            source = None
+        return durations, frames, source
+
+    def _decode_frame(self, source, index, size):
+        source.seek(index)
+        return fit_image(source, size)
+
+    async def _get_frame(self, index) -> Image.Image:
+        if self._frames is not None:
+            return self._frames[index]
+
+        loop = asyncio.get_running_loop()
+        if self._prefetch is not None and self._prefetch[0] == index:
+            frame = await self._prefetch[1]
+        else:
+            frame = await loop.run_in_executor(decode_executor, self._decode_frame, self._source, index, self._loaded_size)
+
+        # Start decoding the next frame while this one is on screen
+        next_index = (index + 1) % self.frame_count
+        self._prefetch = (next_index, loop.run_in_executor(decode_executor, self._decode_frame, self._source, next_index, self._loaded_size))
+        return frame
+
+    async def _play(self):
+        await self._loaded.wait()
+        loop = asyncio.get_running_loop()
+        index = 0
+        next_due = loop.time() + self._durations[0]
+        while self.frame_count > 1:
+            await asyncio.sleep(max(0, next_due - loop.time()))
+            index %= self.frame_count # In case a different file was loaded in the meantime
+            if index + 1 == self.frame_count and not self.loop:
+                return
+
+            # Find the frame that should be on screen right now, skipping any whose time has already passed
+            now = loop.time()
+            index = (index + 1) % self.frame_count
+            while next_due + self._durations[index] <= now and (self.loop or index + 1 < self.frame_count):
+                next_due += self._durations[index]
+                index = (index + 1) % self.frame_count
+                self._count_drop()
+            next_due += self._durations[index]
+
+            if not self._current_shown:
+                self._count_drop() # The previous frame never made it to the panel
+            self._current = await self._get_frame(index)
+            self._current_shown = False
+            self.invalidate()
+            await self.display_manager.request_immediate_draw()
+
+    def _count_drop(self):
+        self.frames_dropped += 1
+        self.display_manager.stats.increment(f"animation.dropped_frames.{self.name}")
+
+    async def draw(self) -> Image:
+        return self._current
+
+    async def screen_updated(self):
+        if not self._current_shown:
+            self._current_shown = True
+            self.frames_shown += 1
+
+    async def resize_requested(self, width, height):
+        await super().resize_requested(width, height)
+        await self.load()
+
+    async def prewarm(self):
+        await self.load()
+
+    async def activated(self):
+        if self._loaded_size is None:
+            asyncio.create_task(self.load())
+        self._play_task = asyncio.create_task(self._play())
+
+    async def deactivated(self):
+        if self._play_task:
+            self._play_task.cancel()
+            self._play_task = None
+
+    async def teardown(self):
+        await self.deactivated()
+        self._close_source()
+
+    def _close_source(self):
+        if self._source is not None:
+            # Queued behind any running prefetch so the file isn't closed out from under it
+            source = self._source
+            self._source = None
+            decode_executor.submit(source.close)
+
+def setup(dim, display_manager, **kwargs):
+    return AnimationPlugin(dim, display_manager, **kwargs)
@@ -1,25 +1,45 @@
 from common.plugin import PluginBase
-
-from PIL import Image, ImageFont, ImageDraw
-from datetime import datetime
-import asyncio
+from common.fonts import atlas
 
 class DebugTextPlugin(PluginBase):
 
+    '''
+    Shows a string of text. The text is only rasterized again when it (or the plugin size) changes.
+    Newlines start a new line, unless multiline is off, in which case the text is shown on a single line.
+    '''
+
+    cache_output = True
+
     def __init__(self, dim, display_manager, *, text = '', multiline = True):
         super().__init__(dim, display_manager)
-        self.text = text
-        self.multiline = multiline
+        self._text = text
+        self._multiline = multiline
+
+    @property
+    def text(self):
+        return self._text
+
+    @text.setter
+    def text(self, value):
+        if value != self._text:
+            self._text = value
+            self.invalidate()
+
+    @property
+    def multiline(self):
+        return self._multiline
+
+    @multiline.setter
+    def multiline(self, value):
+        if value != self._multiline:
+            self._multiline = value
+            self.invalidate()
 
     async def draw(self):
-        font_canvas = Image.new("RGBA", self._canvas_size)
-        draw = ImageDraw.Draw(font_canvas)
-        font = ImageFont.load("assets/fonts/unscii-8-alt.pil")
-        if self.multiline:
-            draw.multiline_text((0, 0), text=self.text, fill=(255, 255, 255), font=font)
-        else:
-            draw.text((0, 0), text=self.text, fill=(255, 255, 255), font=font)
+        font_canvas = self.clear_surface()
+        text = self.text if self._multiline else self.text.replace("\n", " ")
+        atlas.draw_text(font_canvas, (0, 0), text, fill=(255, 255, 255))
         return font_canvas
 
 def setup(dim, display_manager, **kwargs):
-    return DebugTextPlugin(dim, display_manager, **kwargs)
\ No newline at end of file
+    return DebugTextPlugin(dim, display_manager, **kwargs)
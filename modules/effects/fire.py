@@ -0,0 +1,54 @@
+from common.effects import EffectPlugin, gradient_palette, palette_indices, palette_lookup
+
+import numpy as np
+
+PALETTE = gradient_palette([(0, (0, 0, 0)), (60, (120, 0, 0)), (120, (230, 60, 0)), (180, (255, 170, 0)), (230, (255, 240, 120)), (255, (255, 255, 255))])
+
+class FirePlugin(EffectPlugin):
+
+    '''
+    Flames rising from the bottom edge: every step, each cell takes the average heat of the cells
+    below it minus some random cooling, and the bottom row is refilled with random heat.
+    The heat field has a border of one cell so that neighbours are plain slices.
+    '''
+
+    def __init__(self, dim, display_manager, *, cooling: float = 0.4, **kwargs):
+        self.cooling = cooling # Higher values make shorter flames. Scaled by the box height, so flames look the same at any size
+        super().__init__(dim, display_manager, **kwargs)
+
+    def allocate(self, width, height):
+        super().allocate(width, height)
+        self._heat = np.zeros((height + 2, width + 2), dtype = np.float32) # Last row is the fuel source
+        self._next = np.empty((height, width), dtype = np.float32)
+        self._noise = np.empty((height, width), dtype = np.float32)
+        self._fuel = np.empty(width, dtype = np.float32)
+        self._index = palette_indices(height, width)
+
+    def render(self, t, dt):
+        heat, new, noise = self._heat, self._next, self._noise
+        # Fuel: mostly embers with the odd hot spot, which is what makes the flames flicker
+        self.rng.random(dtype = np.float32, out = self._fuel)
+        np.power(self._fuel, 3, out = self._fuel)
+        np.multiply(self._fuel, 600, out = self._fuel)
+        np.minimum(self._fuel, 255, out = self._fuel)
+        heat[-1, 1:-1] = self._fuel
+        heat[:, 0] = heat[:, -2] # Wrap around at the sides
+        heat[:, -1] = heat[:, 1]
+
+        # Average of the three cells below and the one two rows down
+        np.add(heat[2:, :-2], heat[2:, 1:-1], out = new)
+        np.add(new, heat[2:, 2:], out = new)
+        np.add(new, heat[1:-1, 1:-1], out = new)
+        np.multiply(new, 0.25, out = new)
+        self.rng.random(dtype = np.float32, out = noise)
+        np.multiply(noise, self.cooling * 512 / new.shape[0], out = noise)
+        np.subtract(new, noise, out = new)
+        np.maximum(new, 0, out = new)
+        heat[1:-1, 1:-1] = new
+
+        np.minimum(new, 255, out = new)
+        np.copyto(self._index, new, casting = "unsafe")
+        palette_lookup(PALETTE, self._index, self.frame)
+
+def setup(dim, display_manager, **kwargs):
+    return FirePlugin(dim, display_manager, **kwargs)
@@ -0,0 +1,73 @@
+from common.effects import EffectPlugin, gradient_palette, palette_indices, palette_lookup
+
+import numpy as np
+
+PALETTE = gradient_palette([(0, (0, 0, 0)), (1, (255, 255, 255)), (8, (80, 220, 255)), (32, (0, 80, 255)), (255, (40, 0, 120))])
+
+class LifePlugin(EffectPlugin):
+
+    '''
+    Conway's Game of Life on a grid wrapping around at the edges, one cell per pixel, colored by how many
+    generations each cell has been alive. Neighbours are counted by adding eight shifted slices of a
+    copy of the grid with a wrapped border. The grid is reseeded when it dies out or settles down.
+    '''
+
+    def __init__(self, dim, display_manager, *, fps: float = 15, density: float = 0.3, **kwargs):
+        self.density = density
+        super().__init__(dim, display_manager, fps = fps, **kwargs)
+
+    def allocate(self, width, height):
+        super().allocate(width, height)
+        self._padded = np.zeros((height + 2, width + 2), dtype = np.uint8)
+        self._neighbours = np.empty((height, width), dtype = np.uint8)
+        self._alive = np.empty((height, width), dtype = bool)
+        self._born = np.empty((height, width), dtype = bool)
+        self._random = np.empty((height, width), dtype = np.float32)
+        self._age = palette_indices(height, width) # Generations alive, also the palette index
+        self._populations = [] # Recent population counts, to notice when the grid has settled
+        self.seed()
+
+    def seed(self):
+        self.rng.random(dtype = np.float32, out = self._random)
+        np.less(self._random, self.density, out = self._alive)
+        self._age.fill(0)
+        self._populations.clear()
+
+    def step(self):
+        grid = self._padded
+        grid[1:-1, 1:-1] = self._alive
+        grid[0, 1:-1] = grid[-2, 1:-1] # Wrap the border around
+        grid[-1, 1:-1] = grid[1, 1:-1]
+        grid[:, 0] = grid[:, -2]
+        grid[:, -1] = grid[:, 1]
+
+        count = self._neighbours
+        np.add(grid[:-2, :-2], grid[:-2, 1:-1], out = count)
+        for rows, columns in ((slice(None, -2), slice(2, None)), (slice(1, -1), slice(None, -2)), (slice(1, -1), slice(2, None)),
+                              (slice(2, None), slice(None, -2)), (slice(2, None), slice(1, -1)), (slice(2, None), slice(2, None))):
+            np.add(count, grid[rows, columns], out = count)
+
+        # Alive next generation: three neighbours, or two and alive already
+        np.equal(count, 2, out = self._born)
+        np.logical_and(self._born, self._alive, out = self._alive)
+        np.equal(count, 3, out = self._born)
+        np.logical_or(self._alive, self._born, out = self._alive)
+
+        population = int(np.count_nonzero(self._alive))
+        self._populations.append(population)
+        if len(self._populations) > 30:
+            del self._populations[0]
+        # Dead, or the same few populations over and over (still lifes and blinkers)
+        if population == 0 or len(self._populations) == 30 and len(set(self._populations)) <= 3:
+            self.seed()
+
+    def render(self, t, dt):
+        self.step()
+        np.minimum(self._age, 254, out = self._age)
+        np.add(self._age, 1, out = self._age)
+        np.logical_not(self._alive, out = self._born)
+        np.copyto(self._age, 0, where = self._born)
+        palette_lookup(PALETTE, self._age, self.frame)
+
+def setup(dim, display_manager, **kwargs):
+    return LifePlugin(dim, display_manager, **kwargs)
@@ -0,0 +1,50 @@
+from common.effects import EffectPlugin, gradient_palette, palette_indices, palette_lookup
+
+import numpy as np
+
+PALETTE = gradient_palette([(0, (0, 0, 64)), (64, (160, 0, 200)), (128, (255, 80, 40)), (192, (255, 220, 0)), (255, (0, 0, 64))])
+
+class PlasmaPlugin(EffectPlugin):
+
+    '''
+    The classic plasma: a sum of sine waves over x, y, the diagonal and the distance from the centre,
+    looked up in a cycling palette. The per-pixel phase terms are precomputed, so a frame is a few
+    in-place sin() and add() passes over the whole box.
+    '''
+
+    def __init__(self, dim, display_manager, *, scale: float = 1.0, speed: float = 1.0, **kwargs):
+        self.scale = scale # Wave length, relative to a 64 pixel panel
+        self.speed = speed
+        super().__init__(dim, display_manager, **kwargs)
+
+    def allocate(self, width, height):
+        super().allocate(width, height)
+        k = 2 * np.pi / (16 * self.scale)
+        y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+        self._phases = np.stack([
+            x * k,
+            y * k * 0.8,
+            (x + y) * k * 0.5,
+            np.hypot(x - width / 2, y - height / 2) * k,
+        ]) # (4, height, width)
+        self._wave = np.empty((height, width), dtype = np.float32)
+        self._sum = np.empty((height, width), dtype = np.float32)
+        self._index = palette_indices(height, width)
+
+    def render(self, t, dt):
+        t *= self.speed
+        wave, total = self._wave, self._sum
+        total.fill(0)
+        for phase, rate in zip(self._phases, (1.0, 1.3, 0.7, 1.7)):
+            np.add(phase, t * rate, out = wave)
+            np.sin(wave, out = wave)
+            np.add(total, wave, out = total)
+        # total is in [-4, 4]: spread it over the palette, shifted over time to cycle the colors
+        np.multiply(total, 255 / 8, out = total)
+        np.add(total, 128 + t * 40, out = total)
+        np.remainder(total, 256, out = total)
+        np.copyto(self._index, total, casting = "unsafe")
+        palette_lookup(PALETTE, self._index, self.frame)
+
+def setup(dim, display_manager, **kwargs):
+    return PlasmaPlugin(dim, display_manager, **kwargs)
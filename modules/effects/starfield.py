@@ -0,0 +1,72 @@
+from common.effects import EffectPlugin
+
+import numpy as np
+
+class StarfieldPlugin(EffectPlugin):
+
+    '''
+    Flying through a field of stars. Stars are points in 3D that move towards the viewer and are
+    respawned far away once they pass; they are projected and plotted all at once with np.put.
+    Stars off screen land in a one pixel border around the frame instead of being filtered out.
+    The previous frame fades out rather than being cleared, leaving short trails.
+    '''
+
+    def __init__(self, dim, display_manager, *, stars: int = 200, speed: float = 1.0, trails: bool = True, **kwargs):
+        self.star_count = stars
+        self.speed = speed # Depth units per second, the field is 1 deep
+        self.trails = trails
+        super().__init__(dim, display_manager, **kwargs)
+
+    def allocate(self, width, height):
+        super().allocate(width, height)
+        n = self.star_count
+        self._x = self.rng.uniform(-1, 1, n).astype(np.float32)
+        self._y = self.rng.uniform(-1, 1, n).astype(np.float32)
+        self._z = self.rng.uniform(0.05, 1, n).astype(np.float32)
+        self._respawn = np.empty(n, dtype = bool)
+        self._random = np.empty(n, dtype = np.float32)
+        self._projected = np.empty(n, dtype = np.float32)
+        self._column = np.empty(n, dtype = np.intp)
+        self._row = np.empty(n, dtype = np.intp)
+        self._brightness = np.empty(n, dtype = np.uint8)
+        self._sky = np.zeros((height + 2, width + 2), dtype = np.uint8) # With the off screen border
+
+    def _project(self, coordinate, size, out):
+        # Screen position of coordinate / z, offset by one for the border and clamped into it
+        np.divide(coordinate, self._z, out = self._projected)
+        np.multiply(self._projected, size / 2, out = self._projected)
+        np.add(self._projected, size / 2 + 1, out = self._projected)
+        np.clip(self._projected, 0, size + 1, out = self._projected)
+        np.copyto(out, self._projected, casting = "unsafe")
+
+    def render(self, t, dt):
+        height, width = self.frame.shape[:2]
+        z = self._z
+        np.subtract(z, self.speed * dt, out = z)
+        np.less(z, 0.05, out = self._respawn)
+        for coordinate in (self._x, self._y):
+            self.rng.random(dtype = np.float32, out = self._random)
+            np.multiply(self._random, 2, out = self._random)
+            np.subtract(self._random, 1, out = self._random)
+            np.copyto(coordinate, self._random, where = self._respawn)
+        np.copyto(z, 1, where = self._respawn)
+
+        self._project(self._x, width, self._column)
+        self._project(self._y, height, self._row)
+        np.multiply(self._row, width + 2, out = self._row)
+        np.add(self._row, self._column, out = self._row) # Flat index into the sky
+        np.subtract(1, z, out = self._projected)
+        np.multiply(self._projected, 400, out = self._projected) # Full brightness for the closest third
+        np.minimum(self._projected, 255, out = self._projected)
+        np.copyto(self._brightness, self._projected, casting = "unsafe")
+
+        sky = self._sky
+        if self.trails:
+            np.right_shift(sky, 1, out = sky)
+        else:
+            sky.fill(0)
+        np.put(sky, self._row, self._brightness)
+        np.copyto(self.frame, sky[1:-1, 1:-1, None])
+
+def setup(dim, display_manager, **kwargs):
+    return StarfieldPlugin(dim, display_manager, **kwargs)
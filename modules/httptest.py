@@ -1,41 +1,44 @@
 from common.plugin import PluginBase
+from common.fetch import shared_fetcher
 from PIL import Image
-import asyncio
-import aiohttp
-from io import BytesIO
-from random import choice
 
 class TestPlugin(PluginBase):
 
     '''
-    A basic plugin implementation that renders colored squares.
-    In this example, we maintain a single canvas rather than
-    create one for each draw() call.
+    A basic plugin implementation that periodically shows an image from the web.
+    Downloading, caching and decoding is left to the shared fetcher, which only
+    re-downloads the image when the server says it changed.
     '''
 
-    def __init__(self, dimensions, display_manager):
-        self.display_manager = display_manager
-        self._canvas: Image = Image.new("RGB", dimensions)
+    cache_output = True
+
+    def __init__(self, dimensions, display_manager, *, url = "https://i.imgur.com/qYl45gy.png", interval = 5):
+        super().__init__(dimensions, display_manager)
         self.downloaded_image = None
-        self.dimensions = dimensions
-        asyncio.create_task(self.draw_loop())
+        self.url = url
+        self._tick = self.every(interval, self.refresh, align = False)
 
     async def draw(self) -> Image:
         return self.downloaded_image
 
-    async def resize_requested(self, width, height):
-        self._canvas = self._canvas.resize((width, height))
-
-    async def draw_loop(self):
-        while True:
-            await asyncio.sleep(5)
-            async with aiohttp.ClientSession() as sess:
-                async with sess.get("https://i.imgur.com/qYl45gy.png") as resp:
-                    # Subsequent HTTP requests go pretty fast (~100ms), probably because keep-alive
-                    b = BytesIO(await resp.read()) # Consider reading in smaller blocks for larger files to avoid blocking for long periods
-                    self.downloaded_image = Image.open(b).resize(self.dimensions) # Ideally your downloaded image will already be the correct dimensions
-            await self.display_manager.request_immediate_draw()
-        
-
-def setup(dimensions, display_manager):
-    return TestPlugin(dimensions, display_manager)
\ No newline at end of file
+    @property
+    def interval(self) -> float:
+        return self._tick.interval
+
+    @interval.setter
+    def interval(self, value: float):
+        self._tick.interval = value
+
+    async def refresh(self):
+        try:
+            image = await shared_fetcher().fetch_image(self.url, self._canvas_size)
+        except Exception as e:
+            print(f"Warning: {self} could not fetch {self.url}:", e)
+            return
+        if image is not self.downloaded_image: # The fetcher hands back the same instance while the image is unchanged
+            self.downloaded_image = image
+            self.invalidate()
+
+
+def setup(dimensions, display_manager, **kwargs):
+    return TestPlugin(dimensions, display_manager, **kwargs)
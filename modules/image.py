@@ -1,55 +1,131 @@
 from common.plugin import PluginBase
+from common.imaging import ImageCache, decode_executor, load_image
 from PIL import Image
 import asyncio
-import aiohttp
-from io import BytesIO
-from random import choice
+import glob
+import os
 
 class TestPlugin(PluginBase):
 
     '''
-    A basic plugin implementation that renders colored squares.
-    In this example, we maintain a single canvas rather than
-    create one for each draw() call.
+    A slideshow. Shows each image for hold_time seconds while visible.
+
+    Images are only referenced by path when added. They are decoded (and scaled down to
+    the plugin's size) in the background a couple of images before they are needed,
+    and kept in a cache bounded to cache_bytes of decoded pixels.
     '''
 
-    def __init__(self, dimensions, display_manager):
-        self.display_manager = display_manager
-        self._canvas: Image = Image.new("RGB", dimensions)
+    cache_output = True
+
+    def __init__(self, dimensions, display_manager, *, images: list[str] = (), hold_time: float = 10, cache_bytes: int = 8 * 1024 * 1024, prefetch: int = 2):
+        super().__init__(dimensions, display_manager)
         self.dimensions = dimensions
-        self._images = []
+        self._images: list[str] = []
         self._current_image_ind = 0
-        self.hold_time = 10
-        asyncio.create_task(self.scroller_loop())
+        self._current: Image = None
+        self._cache = ImageCache(cache_bytes)
+        self._decoding: dict[tuple, asyncio.Future] = {} # (path, size) -> decode in progress
+        self.prefetch = prefetch # How many upcoming images to decode ahead of time
+        for image in images:
+            self.add_image(image)
+        self._tick = self.every(hold_time, self.next_image, align = False)
+
+    @property
+    def hold_time(self) -> float:
+        return self._tick.interval
+
+    @hold_time.setter
+    def hold_time(self, value: float):
+        self._tick.interval = value
 
     @property
     def images(cls):
-        return cls.images
+        return cls._images
+
+    def add_image(self, image:str, *, encoding = None) -> list[str]:
+        '''
+        Adds an image file, every image in a directory, or every file matching a glob pattern.
+        Nothing is decoded until it is about to be shown. Returns the paths that were added.
+        '''
+        if os.path.isdir(image):
+            extensions = Image.registered_extensions()
+            paths = sorted(entry.path for entry in os.scandir(image) if entry.is_file() and os.path.splitext(entry.name)[1].lower() in extensions)
+        elif glob.has_magic(image):
+            paths = sorted(glob.glob(image))
+        else:
+            paths = [image]
+        self._images.extend(paths)
+        return paths
+
+    def _decode(self, index) -> asyncio.Future:
+        '''
+        Returns a future for the decoded image at index, starting the decode if it isn't cached or already running
+        '''
+        key = (self._images[index], self._canvas_size)
+        future = self._decoding.get(key)
+        if future is not None:
+            return future
 
-    def add_image(self, image:str, *, encoding = None):
-        with open(image, 'rb') as f:
-            img = Image.open(f).convert("RGBA")
-            self._images.append(img)
-            return img
+        image = self._cache.get(key)
+        if image is not None:
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(image)
+            return future
+
+        future = asyncio.get_running_loop().run_in_executor(decode_executor, load_image, key[0], key[1])
+        self._decoding[key] = future
+        def done(future):
+            del self._decoding[key]
+            if not future.cancelled() and future.exception() is None:
+                self._cache.put(key, future.result())
+        future.add_done_callback(done)
+        return future
+
+    async def show_image(self, index):
+        '''
+        Switches to the image at index, waiting for it to be decoded, and starts decoding the ones after it.
+        Images that fail to load are removed from the slideshow.
+        '''
+        while self._images:
+            index %= len(self._images)
+            try:
+                image = await self._decode(index)
+                break
+            except Exception as e:
+                print(f"Warning: {self} could not load {self._images[index]}, removing it:", e)
+                del self._images[index]
+        else:
+            return # Nothing could be loaded
+
+        self._current_image_ind = index
+        self._current = image
+        self.invalidate()
+        for ahead in range(1, self.prefetch + 1):
+            self._decode((index + ahead) % len(self._images))
+
+    async def _show_first_image(self):
+        if self._current is None and self._images:
+            await self.show_image(self._current_image_ind)
 
     async def draw(self) -> Image:
-        try:
-            return self._images[self._current_image_ind]
-        except IndexError:
-            return None
+        await self._show_first_image() # Images may have been added after activation
+        return self._current
 
     async def resize_requested(self, width, height):
-        self._canvas = self._canvas.resize((width, height))
+        await super().resize_requested(width, height)
+        if self._images:
+            await self.show_image(self._current_image_ind)
+
+    async def prewarm(self):
+        await self._show_first_image()
+
+    async def activated(self):
+        await self._show_first_image()
 
-    async def scroller_loop(self):
-        while True:
-            await asyncio.sleep(self.hold_time)
-            self._current_image_ind += 1
-            if self._current_image_ind == len(self._images):
-                self._current_image_ind = 0
-            await self.display_manager.request_immediate_draw()
+    async def next_image(self):
+        if self._images:
+            await self.show_image(self._current_image_ind + 1)
 
-        
 
-def setup(dimensions, display_manager):
-    return TestPlugin(dimensions, display_manager)
\ No newline at end of file
+def setup(dimensions, display_manager, **kwargs):
+    return TestPlugin(dimensions, display_manager, **kwargs)
@@ -0,0 +1,147 @@
+from common.plugin import PluginBase
+from common.fonts import atlas, DEFAULT_FONT
+
+from PIL import Image
+import math
+import time
+
+class MarqueePlugin(PluginBase):
+
+    '''
+    Scrolls a line of text that is wider than the plugin from right to left, looping with a gap.
+
+    The text is rendered once into a strip (again only when the text, font or color change).
+    Every frame just pastes the strip into the plugin's surface at the current offset.
+    The offset follows the monotonic clock rather than counting frames, so the speed (pixels per second)
+    stays the same however late or irregular frames are, and wall clock steps don't make the text jump. A tick aligned to whole pixels of movement
+    requests the draws, so the text only redraws when it has actually moved.
+    Text that fits in the plugin is shown without scrolling.
+    '''
+
+    cache_output = True
+
+    def __init__(self, dim, display_manager, *, text: str = '', font: str = DEFAULT_FONT, color = (255, 255, 255), speed: float = 20, gap: int = 16):
+        super().__init__(dim, display_manager)
+        self._text = text
+        self._font = font
+        self._color = tuple(color)
+        self._speed = speed
+        self.gap = gap
+        self._strip: Image.Image = None
+        self._start = 0
+        self._tick = self.every(0.5, self.scroll)
+        self._restart()
+
+    def _restart(self):
+        '''
+        Starts scrolling from the beginning. The start is put half a pixel before a tick of the scroll timer,
+        which fires on wall clock multiples of 1 / speed, so every tick finds the text moved by exactly one pixel.
+        Only that phase comes from the wall clock, the start itself is on the monotonic clock.
+        '''
+        now = time.monotonic()
+        if self._speed > 0:
+            wall = time.time()
+            self._start = now - (wall - (math.floor(wall * self._speed) - 0.5) / self._speed)
+        else:
+            self._start = now
+        self._update_tick()
+
+    def _update_tick(self):
+        '''
+        Ticks once per pixel while scrolling, and only checks back every half second otherwise
+        '''
+        self._tick.interval = 1 / self._speed if self._speed > 0 and self.scrolling else 0.5
+
+    def _set(self, attribute, value):
+        if getattr(self, attribute) != value:
+            setattr(self, attribute, value)
+            self._strip = None
+            self.invalidate()
+            self._update_tick()
+
+    @property
+    def text(self):
+        return self._text
+
+    @text.setter
+    def text(self, value):
+        restart = value != self._text
+        self._set("_text", value)
+        if restart:
+            self._restart() # Start new text from the beginning
+
+    @property
+    def font(self):
+        return self._font
+
+    @font.setter
+    def font(self, value):
+        self._set("_font", value)
+
+    @property
+    def color(self):
+        return self._color
+
+    @color.setter
+    def color(self, value):
+        self._set("_color", tuple(value))
+
+    @property
+    def speed(self) -> float:
+        '''
+        Pixels per second
+        '''
+        return self._speed
+
+    @speed.setter
+    def speed(self, value: float):
+        if value != self._speed:
+            self._speed = value
+            self._restart()
+
+    @property
+    def strip(self) -> Image.Image:
+        '''
+        The whole text rendered on a single line
+        '''
+        if self._strip is None:
+            self._strip = atlas.render_text(self._text.replace("\n", " "), font = self._font, fill = self._color)
+        return self._strip
+
+    @property
+    def scrolling(self) -> bool:
+        return self.strip.width > self._width
+
+    @property
+    def period(self) -> int:
+        '''
+        Pixels scrolled before the text is back where it started
+        '''
+        return self.strip.width + self.gap
+
+    def offset(self, now: float = None) -> int:
+        '''
+        How many pixels the text has scrolled to the left at time now (time.monotonic())
+        '''
+        if not self.scrolling or self._speed <= 0:
+            return 0
+        now = time.monotonic() if now is None else now
+        return int((now - self._start) * self.speed) % self.period
+
+    async def draw(self):
+        strip = self.strip
+        surface = self.clear_surface()
+        y = (self._height - strip.height) // 2
+        offset = self.offset()
+        surface.paste(strip, (-offset, y)) # No mask needed, the surface was just cleared
+        if self.scrolling and self.period - offset < self._width:
+            surface.paste(strip, (self.period - offset, y)) # The start of the text coming round again
+        return surface
+
+    def scroll(self):
+        self._update_tick() # The size may have changed
+        if self.scrolling and self._speed > 0:
+            self.invalidate()
+
+def setup(dim, display_manager, **kwargs):
+    return MarqueePlugin(dim, display_manager, **kwargs)
@@ -9,8 +9,11 @@ class TestPlugin(PluginBase):
     create one for each draw() call.
     '''
 
+    opaque = True
+    cache_output = True
+
     def __init__(self, dimensions, display_manager):
-        self.display_manager = display_manager
+        super().__init__(dimensions, display_manager)
         self._canvas: Image = Image.new("RGB", dimensions)
 
         self._canvas.paste( (0, 0, 255), (0, 0, self._canvas.width//2, self._canvas.height//2) )
@@ -24,7 +27,10 @@ class TestPlugin(PluginBase):
         return self._canvas
 
     async def resize_requested(self, width, height):
-        self._canvas = self._canvas.resize((width, height))
+        await super().resize_requested(width, height)
+        if self._canvas.size != (width, height):
+            self._canvas = self._canvas.resize((width, height))
+            self.invalidate()
 
     async def layout_switched(self, previous_layout, current_layout):
         print(f"{self}: layout switched from {previous_layout} to {current_layout}")
@@ -0,0 +1,313 @@
+from common.effects import EffectPlugin
+
+from concurrent.futures import ThreadPoolExecutor
+from numpy.lib.stride_tricks import sliding_window_view
+import numpy as np
+import asyncio
+import os
+import sys
+import threading
+import time
+import wave
+
+fft_executor = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = "ledbox-fft")
+
+class RingBuffer():
+
+    '''
+    The most recent samples of a mono float32 stream. Written by the ingest thread, read by the analysis.
+
+    Readers only ever look at the newest samples (latest frame wins): if the analysis falls behind,
+    older samples are simply overwritten.
+    '''
+
+    def __init__(self, capacity: int):
+        self._samples = np.zeros(capacity, dtype = np.float32)
+        self._lock = threading.Lock()
+        self.written = 0 # Total samples ever written
+        self.written_at = None # time.monotonic() when the newest sample arrived
+
+    @property
+    def capacity(self) -> int:
+        return len(self._samples)
+
+    def write(self, samples: np.ndarray, arrived_at: float):
+        samples = samples[-self.capacity:]
+        with self._lock:
+            start = self.written % self.capacity
+            first = min(len(samples), self.capacity - start)
+            self._samples[start:start + first] = samples[:first]
+            self._samples[:len(samples) - first] = samples[first:]
+            self.written += len(samples)
+            self.written_at = arrived_at
+
+    def latest(self, out: np.ndarray) -> tuple[int, float]:
+        '''
+        Copies the newest len(out) samples into out. Returns (written, written_at) as of the copy.
+        '''
+        count = len(out)
+        with self._lock:
+            end = self.written % self.capacity
+            if count <= end:
+                out[:] = self._samples[end - count:end]
+            else:
+                out[:count - end] = self._samples[self.capacity - (count - end):]
+                out[count - end:] = self._samples[:end]
+            return self.written, self.written_at
+
+class PCMReader():
+
+    '''
+    Reads audio into a RingBuffer on a thread of its own, so ingest never waits on rendering (or the other way round).
+
+    source is a WAV file (played back in real time, looping if loop is set), "-" for raw PCM on stdin,
+    or the path of a file or named pipe carrying raw PCM, e.g. one fed by `arecord -t raw -f S16_LE -r 44100`.
+    Raw PCM is signed 16-bit little endian with the given sample_rate and channels; channels are mixed down to mono.
+    '''
+
+    def __init__(self, source: str, *, sample_rate: int = 44100, channels: int = 1, loop: bool = True, chunk: int = 512):
+        self.source = source
+        self.loop = loop
+        self.chunk = chunk # Frames per read, which bounds how stale the newest sample can be
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self._wave = None
+        self._file = None
+        self.sample_width = 2
+        if source.lower().endswith(".wav"):
+            self._wave = wave.open(source, "rb")
+            self.sample_rate = self._wave.getframerate()
+            self.channels = self._wave.getnchannels()
+            self.sample_width = self._wave.getsampwidth()
+            if self.sample_width not in (1, 2, 4):
+                raise ValueError(f"Unsupported WAV sample width of {self.sample_width * 8} bits")
+        self.buffer: RingBuffer = None
+        self._thread = None # The reading thread, None once it has exited
+        self._lock = threading.Lock() # Guards _thread against a thread deciding to exit while start() is reusing it
+        self._stop = threading.Event()
+
+    def _open(self):
+        '''
+        Opens a raw source. Called on the reading thread: opening a named pipe blocks until a writer attaches.
+        '''
+        if self._wave is None and self._file is None:
+            self._file = sys.stdin.buffer if self.source == "-" else open(self.source, "rb")
+
+    def _exit(self, stopping: bool) -> bool:
+        '''
+        Called by the reading thread to decide whether to stop. Returns True if it should exit,
+        in which case it is forgotten so the next start() starts a new one.
+        '''
+        with self._lock:
+            if stopping and not self._stop.is_set():
+                return False # Restarted in the meantime
+            self._thread = None
+            return True
+
+    def _convert(self, data: bytes) -> np.ndarray:
+        usable = len(data) - len(data) % (self.sample_width * self.channels)
+        if self.sample_width == 1:
+            samples = (np.frombuffer(data, np.uint8, usable).astype(np.float32) - 128) / 128
+        elif self.sample_width == 2:
+            samples = np.frombuffer(data, "<i2", usable // 2).astype(np.float32) / 32768
+        else:
+            samples = np.frombuffer(data, "<i4", usable // 4).astype(np.float32) / 2147483648
+        if self.channels > 1:
+            samples = samples.reshape(-1, self.channels).mean(axis = 1)
+        return samples
+
+    def _read(self) -> bytes:
+        if self._wave is not None:
+            data = self._wave.readframes(self.chunk)
+            if not data and self.loop:
+                self._wave.rewind()
+                data = self._wave.readframes(self.chunk)
+            return data
+        return os.read(self._file.fileno(), self.chunk * self.sample_width * self.channels)
+
+    def _run(self):
+        try:
+            self._open()
+        except OSError as e:
+            print(f"Warning: could not open audio source {self.source}:", e)
+            self._exit(False)
+            return
+        start = time.monotonic()
+        frames = 0
+        leftover = b""
+        while not (self._stop.is_set() and self._exit(True)):
+            data = self._read()
+            if not data:
+                self._exit(False) # End of the file or pipe
+                return
+            data = leftover + data
+            frame_bytes = self.sample_width * self.channels
+            leftover = data[len(data) - len(data) % frame_bytes:]
+            samples = self._convert(data)
+            if self._wave is not None:
+                # Play files back in real time, as if they were being captured
+                frames += len(samples)
+                delay = start + frames / self.sample_rate - time.monotonic()
+                if delay > 0:
+                    self._stop.wait(delay)
+            self.buffer.write(samples, time.monotonic())
+
+    def start(self, buffer: RingBuffer):
+        '''
+        Starts reading into buffer. A thread that was asked to stop but hasn't yet carries on instead.
+        Never blocks: the source is opened on the reading thread.
+        '''
+        with self._lock:
+            self.buffer = buffer
+            self._stop.clear()
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target = self._run, name = "ledbox-audio", daemon = True)
+            self._thread.start()
+
+    def stop(self):
+        '''
+        Stops reading after the current chunk. Reading a pipe blocks until data arrives, so the thread may linger until then.
+        '''
+        self._stop.set()
+
+    def close(self):
+        self.stop()
+        if self._wave is not None:
+            self._wave.close()
+        elif self._file is not None and self._file is not sys.stdin.buffer:
+            self._file.close()
+
+class VisualizerPlugin(EffectPlugin):
+
+    '''
+    A spectrum analyzer: bars for logarithmically spaced frequency bands, with falling peak markers.
+
+    Audio is read by a PCMReader on its own thread into a ring buffer. fps times a second, the newest samples
+    are analysed off the event loop: every window (fft_size samples, Hann windowed) hopping through the audio
+    that arrived since the last analysis is transformed in one batched FFT, and each band keeps its loudest
+    value across the batch so short sounds between frames still show. Levels rise immediately and fall over
+    decay seconds. Rendering only turns the latest levels into bars, so it never waits for audio or the FFT.
+
+    Records visualizer.fft_ms, visualizer.windows and visualizer.latency_ms (from the newest analysed sample
+    arriving to the frame showing it being pushed to the panel) in the display manager's stats.
+    '''
+
+    def __init__(self, dim, display_manager, *, source: str, sample_rate: int = 44100, channels: int = 1, loop: bool = True,
+                 fps: float = 30, fft_size: int = 2048, max_batch: int = 8, bar_width: int = 2, min_freq: float = 40, max_freq: float = 16000,
+                 floor_db: float = -60, decay: float = 0.3, peak_fall: float = 0.5, **kwargs):
+        self.reader = PCMReader(source, sample_rate = sample_rate, channels = channels, loop = loop)
+        self.fft_size = fft_size
+        self.hop = max(1, round(self.reader.sample_rate / fps / 2)) # Two windows per frame, more if frames are late
+        self.max_batch = max_batch
+        self.bar_width = bar_width
+        self.min_freq = min_freq
+        self.max_freq = min(max_freq, self.reader.sample_rate / 2)
+        self.floor_db = floor_db
+        self.decay = decay
+        self.peak_fall = peak_fall # Peak markers fall this fraction of the height per second
+        self._ring = RingBuffer(max(fft_size + max_batch * self.hop, self.reader.sample_rate))
+        self._window = np.hanning(fft_size).astype(np.float32)
+        self._scale = 2 / self._window.sum() # A full scale sine reads as 0 dB
+        self._analysed = 0 # ring.written at the last analysis
+        self._pending_latency = None # Arrival time of the newest sample in the frame being drawn
+        super().__init__(dim, display_manager, fps = fps, **kwargs)
+
+    def allocate(self, width, height):
+        super().allocate(width, height)
+        bars = max(1, width // self.bar_width)
+        # FFT bins where every band starts, spaced evenly in log frequency and at least one bin apart
+        edges = np.geomspace(self.min_freq, self.max_freq, bars + 1) * self.fft_size / self.reader.sample_rate
+        starts = np.maximum(np.floor(edges[:-1]).astype(np.intp), 1)
+        for index in range(1, bars):
+            starts[index] = max(starts[index], starts[index - 1] + 1)
+        self._band_starts = np.minimum(starts, self.fft_size // 2 - 1)
+        self._targets = np.zeros(bars, dtype = np.float32) # Latest analysed levels, 0 - 1
+        self._levels = np.zeros(bars, dtype = np.float32) # Smoothed levels shown
+        self._peaks = np.zeros(bars, dtype = np.float32)
+        self._scratch = np.empty(self.fft_size + (self.max_batch - 1) * self.hop, dtype = np.float32)
+
+        # Bars are drawn by masking a gradient, green at the bottom to red at the top
+        ramp = np.linspace(1, 0, height, dtype = np.float32)[:, None]
+        colors = np.concatenate([np.minimum(1, 2 * (1 - ramp)), np.minimum(1, 2 * ramp), np.zeros_like(ramp)], axis = 1) * 255
+        self._gradient = np.ascontiguousarray(np.broadcast_to(colors[:, None, :], (height, width, 3)).astype(np.uint8))
+        self._gradient[:, self.bar_width - 1::self.bar_width] //= 4 # Dim the last column of every bar to separate them
+        self._rows = np.arange(height, 0, -1, dtype = np.float32)[:, None] # Height above the bottom of every row
+        self._column_bar = np.minimum(np.arange(width) // self.bar_width, bars - 1)
+        self._column_levels = np.empty(width, dtype = np.float32)
+        self._mask = np.empty((height, width), dtype = bool)
+        self._peak_heights = np.empty(bars, dtype = np.float32)
+        self._peak_rows = np.empty(bars, dtype = np.intp)
+        # Peak markers span every column of a bar but the dimmed one
+        columns = np.arange(bars) * self.bar_width
+        self._peak_columns = [np.minimum(columns + offset, width - 1) for offset in range(max(1, self.bar_width - 1))]
+
+    def _analyse(self):
+        '''
+        Runs in an executor. Returns the loudest level of every band in the audio since the last analysis,
+        and when the newest sample arrived, or None if no new audio arrived.
+        '''
+        start = time.perf_counter()
+        written, arrived_at = self._ring.latest(self._scratch)
+        new = written - self._analysed
+        if new <= 0 or written < self.fft_size:
+            return None
+        self._analysed = written
+        count = min(self.max_batch, max(1, new // self.hop))
+        samples = self._scratch[len(self._scratch) - self.fft_size - (count - 1) * self.hop:]
+        windows = sliding_window_view(samples, self.fft_size)[::self.hop] # (count, fft_size), no copy
+        spectrum = np.abs(np.fft.rfft(windows * self._window, axis = 1)).max(axis = 0) * self._scale
+        bands = np.maximum.reduceat(spectrum, self._band_starts)
+        levels = (20 * np.log10(bands + 1e-9) - self.floor_db) / -self.floor_db
+        self.display_manager.stats.record("visualizer.fft_ms", (time.perf_counter() - start) * 1000)
+        self.display_manager.stats.record("visualizer.windows", count)
+        return np.clip(levels, 0, 1, out = levels), arrived_at
+
+    async def advance(self):
+        result = await asyncio.get_running_loop().run_in_executor(fft_executor, self._analyse)
+        if result is not None:
+            levels, arrived_at = result
+            if len(levels) == len(self._targets): # Unless resized in the meantime
+                self._targets[:] = levels
+                self._pending_latency = arrived_at
+        self.invalidate() # Levels keep falling while there is no new audio
+
+    def render(self, t, dt):
+        levels, peaks = self._levels, self._peaks
+        # Rise immediately, fall exponentially
+        np.multiply(levels, np.exp(-dt / self.decay) if self.decay > 0 else 0, out = levels)
+        np.maximum(levels, self._targets, out = levels)
+        np.subtract(peaks, self.peak_fall * dt, out = peaks)
+        np.maximum(peaks, levels, out = peaks)
+
+        height = self.frame.shape[0]
+        np.take(levels, self._column_bar, out = self._column_levels)
+        np.multiply(self._column_levels, height, out = self._column_levels)
+        np.less_equal(self._rows, self._column_levels, out = self._mask)
+        np.multiply(self._gradient, self._mask[:, :, None], out = self.frame)
+
+        # Peak markers, one row above where the bar reached
+        np.multiply(peaks, height, out = self._peak_heights)
+        np.copyto(self._peak_rows, self._peak_heights, casting = "unsafe")
+        np.subtract(height - 1, self._peak_rows, out = self._peak_rows)
+        np.clip(self._peak_rows, 0, height - 1, out = self._peak_rows)
+        for columns in self._peak_columns:
+            self.frame[self._peak_rows, columns] = 255
+
+    async def screen_updated(self):
+        if self._pending_latency is not None:
+            self.display_manager.stats.record("visualizer.latency_ms", (time.monotonic() - self._pending_latency) * 1000)
+            self._pending_latency = None
+
+    async def activated(self):
+        self.reader.start(self._ring)
+
+    async def deactivated(self):
+        await super().deactivated()
+        self.reader.stop()
+
+    async def teardown(self):
+        self.reader.close()
+
+def setup(dim, display_manager, **kwargs):
+    return VisualizerPlugin(dim, display_manager, **kwargs)
@@ -2,10 +2,46 @@ import common.display_manager as dm
 import time
 import math
 import asyncio
+import argparse
 
-# For some reason importlib throws a fit when I don't do this ¯\_(ツ)_/¯
-from modules import test, httptest, clock, image, debug
 from common.util import get_ip
+from common.config import LayoutConfig
+from common.output import DoubleBufferedOutput, MatrixOutput, NullOutput, RawFrameWriter
+from common.fakematrix import FakeRGBMatrix
+from common.stats import StatsServer
+from common.color import ColorPipeline, ColorCorrectedOutput, DITHER_MODES
+
+parser = argparse.ArgumentParser(description = "LED Box")
+parser.add_argument("--render-mode", choices = dm.RENDER_MODES, default = "inline",
+                    help = "Where compositing and matrix updates run. 'thread' keeps them off the event loop.")
+parser.add_argument("--compositor", choices = ("pil", "numpy"), default = "pil",
+                    help = "How layouts are composited. 'numpy' blends into a preallocated NumPy frame buffer.")
+parser.add_argument("--double-buffer", action = "store_true",
+                    help = "Draw into an offscreen canvas and swap it in on vsync instead of updating the panel directly")
+parser.add_argument("--fake-matrix", action = "store_true",
+                    help = "Use an emulated matrix instead of rgbmatrix (for machines without a HAT)")
+parser.add_argument("--output", choices = ("matrix", "null", "raw"), default = "matrix",
+                    help = "Where frames go. 'raw' writes RGB24 frames to --raw-path, 'null' discards them.")
+parser.add_argument("--raw-path", default = "-",
+                    help = "File or pipe for --output raw ('-' for stdout, other output then goes to stderr)")
+parser.add_argument("--gamma", type = float, default = 1.0,
+                    help = "Gamma curve applied to every frame before output (e.g. 2.2 for perceptually even fades on the panel)")
+parser.add_argument("--white-balance", default = "1,1,1", metavar = "R,G,B",
+                    help = "Per-channel gains applied before output, e.g. 1,0.85,0.7 to warm up a blue-ish panel")
+parser.add_argument("--brightness", type = float, default = 100,
+                    help = "Software brightness in percent, on top of the panel's hardware brightness. Can be changed at runtime through the color pipeline.")
+parser.add_argument("--dither", choices = DITHER_MODES, default = "none",
+                    help = "Dither the color corrected frames to hide banding. 'temporal' also varies the pattern from frame to frame.")
+parser.add_argument("--tile", action = "append", metavar = "X,Y,WIDTH,HEIGHT,TARGET",
+                    help = "Drive a panel wall: shows this part of the canvas on TARGET, which is 'local' (the output picked above) "
+                           "or udp://host:port or tcp://host:port (a receiver started with python -m common.wall). Can be repeated.")
+parser.add_argument("--config", default = "layouts.toml",
+                    help = "TOML or JSON file describing the layouts to show. Changes are applied while running.")
+parser.add_argument("--stats-port", type = int,
+                    help = "Serve frame and plugin timing stats as JSON over HTTP on this local port")
+parser.add_argument("--stats-socket",
+                    help = "Serve frame and plugin timing stats as JSON on this Unix socket")
+args = parser.parse_args()
 
 matrix = None
 try:
@@ -19,13 +55,57 @@ try:
     options.hardware_mapping = 'adafruit-hat-pwm'
     options.pixel_mapper_config = 'U-mapper;Rotate:180'
 
-    matrix = RGBMatrix(options = options)
+    if not args.fake_matrix:
+        matrix = RGBMatrix(options = options)
 except ImportError:
     pass
 
-display_manager = dm.DisplayManager(matrix, width=64, height=64)
+if args.fake_matrix:
+    matrix = FakeRGBMatrix(width = 64, height = 64, refresh_rate = 120)
+
+output = None
+if args.output == "null":
+    output = NullOutput()
+elif args.output == "raw":
+    output = RawFrameWriter(args.raw_path)
+elif matrix is None:
+    print("Warning: rgbmatrix could not be imported, frames will be discarded. Use --fake-matrix or --output to pick another output.")
+    output = NullOutput()
+elif args.double_buffer:
+    output = DoubleBufferedOutput(matrix)
+
+width, height = 64, 64
+wall = None
+if args.tile:
+    from common.wall import TiledOutput, RemoteTile
+    local = output or (MatrixOutput(matrix) if matrix is not None else NullOutput())
+    wall = TiledOutput()
+    for index, spec in enumerate(args.tile):
+        *box, target = spec.split(",")
+        x, y, tile_width, tile_height = (int(value) for value in box)
+        wall.add_tile((x, y, x + tile_width, y + tile_height), local if target == "local" else RemoteTile.from_url(target, tile = index))
+    output = wall
+    width, height = wall.size
+
+# Correct the whole canvas, so remote tiles of a wall match the local one
+color = ColorPipeline(gamma = args.gamma, white_balance = [float(gain) for gain in args.white_balance.split(",")],
+                      brightness = args.brightness / 100, dither = args.dither)
+color_output = None
+if not color.identity:
+    output = color_output = ColorCorrectedOutput(output or (MatrixOutput(matrix) if matrix is not None else NullOutput()), color)
+
+display_manager = dm.DisplayManager(matrix, output=output, width=width, height=height, render_mode=args.render_mode, compositor=args.compositor)
+for stage in (wall, color_output):
+    if stage is not None:
+        stage.stats = display_manager.stats
 
 async def main():
+    display_manager.start_scheduler()
+    if args.stats_port or args.stats_socket:
+        stats_server = StatsServer(display_manager.stats, port = args.stats_port, path = args.stats_socket)
+        await stats_server.start()
+    config = LayoutConfig(display_manager, args.config)
+    startup_layout = None
     try:
         ip_addr = get_ip()
         startup_layout = display_manager.new_layout()
@@ -33,35 +113,18 @@ async def main():
 
         await display_manager.switch_layout(startup_layout)
         await asyncio.sleep(10)
-        # TODO: Implement layout removal and do it here?
     except:
         pass
 
-    l = display_manager.new_layout()
-    #clock_plugin = l.add_plugin("modules.clock", width = 40, height = 10, x = 64//2-20, y = 64//2-8, z_index=1)
-    #l.debug_borders = True
-    p = l.add_plugin("modules.image", width = 64, height = 64, x = 0, y = 0)
-    p.add_image("assets/images/testalbumcover.png", encoding = "utf-8")
-    p.add_image("assets/images/testalbumcover2.png", encoding = "utf-8")
-    p.hold_time = 3
+    try:
+        await config.reload() # Prewarms the first configured layout before switching to it
+    except Exception as e:
+        print(f"Warning: could not load {args.config}, waiting for it to be fixed:", e) # The watcher retries once the file changes
+    config.watch()
+    if startup_layout is not None and startup_layout is not display_manager.current_layout:
+        await display_manager.unregister_layout(startup_layout)
 
-    await display_manager.switch_layout(l)
-    
-    counter = 0
-    while True:
-        #await l.change_plugin_coords(clock_plugin, x = int((math.cos(counter) + 1)*32))
-        #await display_manager.request_immediate_draw()
-        await asyncio.sleep(1/10)
-        #await l.change_plugin_coords(clock_plugin, z_index=1)
-        counter += 0.1
-        # start_time = time.perf_counter()
-        # await display_manager.update_display()
-        # interframe_time = time.perf_counter() - end_time
-        # end_time = time.perf_counter()
-        # total_time = end_time - start_time
-        # print(f"Frame time: {total_time*1000} ms, {1/total_time} fps, {interframe_time} dT")
-        # print("Changing plugin coords")
-        # await l.change_plugin_coords(p, x = randint(0, 32), y = randint(0, 32))
+    await asyncio.Event().wait() # Everything else happens in background tasks
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,45 @@
+from common import color
+from common.color import ColorPipeline, ColorCorrectedOutput
+from common.output import OutputBackend
+from PIL import Image
+
+import unittest
+from unittest import mock
+
+class BufferOutput(OutputBackend):
+
+    '''
+    Takes raw buffers like NullOutput and RawFrameWriter do, keeping whatever it was last given
+    '''
+
+    accepts_buffer = True
+
+    def __init__(self):
+        self.image = None
+        self.buffer = None
+
+    def show(self, image):
+        self.image = image.copy()
+
+    def show_buffer(self, buffer):
+        self.buffer = buffer.copy()
+
+class ColorCorrectedOutputTest(unittest.TestCase):
+
+    def test_without_numpy(self):
+        output = BufferOutput()
+        with mock.patch.object(color, "np", None):
+            corrected = ColorCorrectedOutput(output, ColorPipeline(brightness = 0.5))
+            self.assertFalse(corrected.accepts_buffer)
+            corrected.show(Image.new("RGB", (4, 4), (200, 100, 0)))
+        self.assertIsNone(output.buffer)
+        self.assertEqual(output.image.getpixel((0, 0)), (100, 50, 0))
+
+    def test_buffer_output(self):
+        output = BufferOutput()
+        corrected = ColorCorrectedOutput(output, ColorPipeline(brightness = 0.5))
+        corrected.show(Image.new("RGB", (4, 4), (200, 100, 0)))
+        self.assertEqual(tuple(output.buffer[0, 0]), (100, 50, 0))
+
+if __name__ == "__main__":
+    unittest.main()
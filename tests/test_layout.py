@@ -0,0 +1,45 @@
+import common.display_manager as dm
+from common.output import NullOutput
+from common.plugin import PluginBase
+
+import asyncio
+import unittest
+
+class TickingPlugin(PluginBase):
+
+    def __init__(self, dimensions, display_manager):
+        super().__init__(dimensions, display_manager)
+        self.ticks = 0
+        self.activations = 0
+        self.every(0.02, self.tick, align = False)
+
+    def tick(self):
+        self.ticks += 1
+
+    async def activated(self):
+        self.activations += 1
+
+class AddPluginTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.display_manager = dm.DisplayManager(output = NullOutput(), width = 64, height = 64)
+        self.layout = self.display_manager.new_layout()
+
+    async def test_plugin_added_to_visible_layout_ticks(self):
+        await self.display_manager.switch_layout(self.layout)
+        plugin = self.layout.add_plugin(TickingPlugin((8, 8), self.display_manager), width = 8, height = 8)
+        await asyncio.sleep(0.2)
+        self.assertEqual(plugin.activations, 1)
+        self.assertGreater(plugin.ticks, 0)
+
+    async def test_plugin_added_to_hidden_layout_waits_for_switch(self):
+        plugin = self.layout.add_plugin(TickingPlugin((8, 8), self.display_manager), width = 8, height = 8)
+        await asyncio.sleep(0.1)
+        self.assertEqual((plugin.activations, plugin.ticks), (0, 0))
+        await self.display_manager.switch_layout(self.layout)
+        await asyncio.sleep(0.1)
+        self.assertEqual(plugin.activations, 1)
+        self.assertGreater(plugin.ticks, 0)
+
+if __name__ == "__main__":
+    unittest.main()